@@ -1,26 +1,154 @@
 """Disassembler of Python byte code into mnemonics."""
 
 from __future__ import print_function
+import os
 import sys
+import imp
+import array
+import bisect
 import types
 import collections
-import contextlib
-import StringIO
+import functools
+import itertools
 import marshal
+from timeit import default_timer as _timer
 
 from opcode import *
 from opcode import __all__ as _opcodes_all
 
 __all__ = ["code_info", "dis", "disassemble", "distb", "disco",
            "findlinestarts", "findlabels", "show_code",
-           "get_instructions", "Instruction", "Bytecode"] + _opcodes_all
+           "get_instructions", "Instruction", "Bytecode",
+           "stack_effect", "stack_depths", "max_stack_depth",
+           "enable_cache", "disable_cache", "cache_clear", "cache_info",
+           "enable_disk_cache", "disable_disk_cache", "disk_cache_info",
+           "enable_stats", "disable_stats", "stats", "reset_stats",
+           "InstructionColumns", "BasicBlock", "ControlFlowGraph", "diff",
+           "assemble", "PycArchive", "dis_files", "OpcodeStats",
+           "opcode_stats"] + _opcodes_all
 del _opcodes_all
 
 _have_code = (types.MethodType, types.FunctionType, types.CodeType,
               classmethod, staticmethod, type)
 
 hasnargs = [131, 140, 141, 142]
-__all__ += [hasnargs]
+__all__ += ["hasnargs"]
+
+# How the argument of each opcode is resolved into argval/argrepr. The table
+# is indexed by opcode so the decode loop does a single lookup instead of
+# scanning the has* lists. Earlier entries in _arg_kind_order take precedence
+# where an opcode appears in more than one list.
+_ARG_PLAIN, _ARG_CONST, _ARG_NAME, _ARG_JREL, _ARG_LOCAL, _ARG_COMPARE, \
+    _ARG_FREE, _ARG_NARGS = range(8)
+
+_arg_kind_order = [(_ARG_CONST, hasconst), (_ARG_NAME, hasname),
+                   (_ARG_JREL, hasjrel), (_ARG_LOCAL, haslocal),
+                   (_ARG_COMPARE, hascompare), (_ARG_FREE, hasfree),
+                   (_ARG_NARGS, hasnargs)]
+
+_arg_kinds = [_ARG_PLAIN] * 256
+for _kind, _ops in reversed(_arg_kind_order):
+    for _op in _ops:
+        _arg_kinds[_op] = _kind
+del _kind, _ops, _op
+
+# Interned so every Instruction with the same opcode shares one opname string
+_opnames = [intern(name) for name in opname]
+
+_hasjrel = frozenset(hasjrel)
+_hasjabs = frozenset(hasjabs)
+
+
+Stats = collections.namedtuple("Stats", "counters timers")
+
+# The active _Stats while instrumentation is enabled. Every hook tests this
+# for None first, so disabled instrumentation costs one global lookup per
+# phase rather than per instruction.
+_stats = None
+
+
+class _Stats(object):
+    """Counters and cumulative per-phase times collected while enabled."""
+
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.timers = collections.Counter()
+
+    def iterate(self, iterable, phase, counter):
+        """Wrap *iterable*, timing each step as *phase* and counting the
+        items produced as *counter*, unless that is None."""
+        iterator = iter(iterable)
+        timers = self.timers
+        counters = self.counters
+        while True:
+            start = _timer()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                timers[phase] += _timer() - start
+                return
+            timers[phase] += _timer() - start
+            if counter is not None:
+                counters[counter] += 1
+            yield item
+
+    def snapshot(self):
+        return Stats(dict(self.counters), dict(self.timers))
+
+
+def _timed(phase):
+    """Decorate a function to add its running time to the *phase* timer."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            stats = _stats
+            if stats is None:
+                return function(*args, **kwargs)
+            start = _timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stats.timers[phase] += _timer() - start
+        return wrapper
+    return decorate
+
+
+def enable_stats():
+    """Start collecting counters and per-phase timings, from zero.
+
+    Counters are code_objects, bytes_decoded, instructions, reprs and
+    lines_written; timers, in seconds, are lookup, linestarts, labels,
+    decode, resolve, format and write. Phases nest where one drives
+    another: format includes resolving the instructions it formats, and
+    labels the decode it needs. Collection is per process.
+    """
+    global _stats
+    _stats = _Stats()
+
+
+def disable_stats():
+    """Stop collecting counters and timings, discarding those collected."""
+    global _stats
+    _stats = None
+
+
+def stats(reset=False):
+    """Return a Stats snapshot of the counters and timers as dicts, or None
+    if instrumentation is not enabled. With *reset* true, start again from
+    zero after taking the snapshot.
+    """
+    if _stats is None:
+        return None
+    snapshot = _stats.snapshot()
+    if reset:
+        enable_stats()
+    return snapshot
+
+
+def reset_stats():
+    """Set all counters and timers back to zero, if enabled."""
+    if _stats is not None:
+        enable_stats()
 
 
 def _try_compile(source, name):
@@ -42,15 +170,32 @@ def _try_compile(source, name):
     return c
 
 
-def dis(x=None, file=None):
+def dis(x=None, file=None, depth=0):
     """Disassemble classes, methods, functions, generators, or code.
 
     With no argument, disassemble the last traceback.
 
+    Code objects nested in the constants of the disassembled code (lambdas,
+    comprehensions, inner functions and class bodies) are disassembled too,
+    up to *depth* levels deep. A *depth* of None means no limit.
+
+    Raw bytecode may be given as a bytearray, buffer or memoryview. A str
+    is compiled as source, unless it cannot be compiled and contains
+    control characters, in which case it is taken as raw bytecode.
+
     """
     if x is None:
         distb(file=file)
         return
+    _dis(x, file, depth, set())
+
+
+def _dis(x, file, depth, seen):
+    """Implementation of dis() for a single traversal.
+
+    *seen* holds the ids of the classes, modules and nested code objects
+    already visited, so that cyclic references are only followed once.
+    """
     if hasattr(x, '__func__'):  # Method
         x = x.__func__
     if hasattr(x, '__code__'):  # Function
@@ -58,21 +203,23 @@ def dis(x=None, file=None):
     if hasattr(x, 'gi_code'):  # Generator
         x = x.gi_code
     if hasattr(x, '__dict__'):  # Class or module
+        if id(x) in seen:
+            return
+        seen.add(id(x))
         items = sorted(x.__dict__.items())
         for name, x1 in items:
             # removed try catch on TypeError, since we already check that
             # x1 is an instance of something that has code
             if isinstance(x1, _have_code):
                 print("Disassembly of %s:" % name, file=file)
-                dis(x1, file=file)
+                _dis(x1, file, depth, seen)
                 print(file=file)
     elif hasattr(x, 'co_code'):  # Code object
-        disassemble(x, file=file)
-    # TODO : ?
-    # elif isinstance(x, (bytes, bytearray)):  # Raw bytecode
-    #     _disassemble_bytes(x, file=file)
-    elif isinstance(x, str):  # Source code
-        _disassemble_str(x, file=file)
+        _disassemble_recursive(x, file, depth, seen)
+    elif isinstance(x, (bytearray, buffer, memoryview)):  # Raw bytecode
+        _disassemble_bytes(x, file=file)
+    elif isinstance(x, str):  # Source code or raw bytecode
+        _disassemble_str(x, file=file, depth=depth)
     else:
         raise TypeError("don't know how to disassemble %s objects" %
                         type(x).__name__)
@@ -120,6 +267,7 @@ def pretty_flags(flags):
     return ", ".join(names)
 
 
+@_timed('lookup')
 def _get_code_object(x):
     """Helper to handle methods, functions, generators, strings and raw code objects"""
     if hasattr(x, '__func__'):  # Method
@@ -138,7 +286,11 @@ def _get_code_object(x):
 
 def code_info(x):
     """Formatted details of methods, functions, or code."""
-    return _format_code_info(_get_code_object(x))
+    co = _get_code_object(x)
+    if _code_cache is None and _disk_cache is None:
+        # Nothing to look up or keep, so skip decoding the code object
+        return _format_code_info(co)
+    return _get_decoded(co).info()
 
 
 def _format_code_info(co):
@@ -191,6 +343,68 @@ _Instruction = collections.namedtuple("_Instruction",
                                       "opname opcode arg argval argrepr offset starts_line is_jump_target")
 
 
+class _LazyRepr(object):
+    """Placeholder for an argrepr which is computed on first use.
+
+    Compares, hashes, formats and pickles as the repr() of the wrapped
+    value, so an Instruction holding one behaves like a tuple holding the
+    string.
+    """
+
+    __slots__ = ('_value', '_repr')
+
+    def __init__(self, value):
+        self._value = value
+        self._repr = None
+
+    def get(self):
+        if self._repr is None:
+            self._repr = repr(self._value)
+            if _stats is not None:
+                _stats.counters['reprs'] += 1
+        return self._repr
+
+    def __eq__(self, other):
+        return self.get() == _resolve_argrepr(other)
+
+    def __ne__(self, other):
+        return self.get() != _resolve_argrepr(other)
+
+    def __lt__(self, other):
+        return self.get() < _resolve_argrepr(other)
+
+    def __le__(self, other):
+        return self.get() <= _resolve_argrepr(other)
+
+    def __gt__(self, other):
+        return self.get() > _resolve_argrepr(other)
+
+    def __ge__(self, other):
+        return self.get() >= _resolve_argrepr(other)
+
+    def __hash__(self):
+        return hash(self.get())
+
+    def __repr__(self):
+        return repr(self.get())
+
+    def __str__(self):
+        return self.get()
+
+    def __format__(self, format_spec):
+        return format(self.get(), format_spec)
+
+    def __reduce__(self):
+        return str, (self.get(),)
+
+
+def _resolve_argrepr(value):
+    """Return the string for a field value which may be a _LazyRepr."""
+    if type(value) is _LazyRepr:
+        return value.get()
+    return value
+
+
 class Instruction(_Instruction):
     """Details for a bytecode operation
 
@@ -203,8 +417,31 @@ class Instruction(_Instruction):
          offset - start index of operation within bytecode sequence
          starts_line - line started by this opcode (if any), otherwise None
          is_jump_target - True if other code jumps to here, otherwise False
+
+       The argrepr of a constant is only computed when it is first read
+       through the argrepr attribute or by iterating over the instruction,
+       as unpacking, tuple() and list() do. Indexing and slicing keep the
+       fast tuple access used by the field attributes, so instr[4] may be
+       a placeholder, which compares, hashes and formats as the string but
+       is not a str.
     """
 
+    __slots__ = ()
+
+    @property
+    def argrepr(self):
+        """human readable description of operation argument"""
+        return _resolve_argrepr(tuple.__getitem__(self, 4))
+
+    def __iter__(self):
+        return iter(self[:4] + (_resolve_argrepr(self[4]),) + self[5:])
+
+    def _asdict(self):
+        return collections.OrderedDict(zip(self._fields, self))
+
+    def __repr__(self):
+        return repr(_Instruction._make(self))
+
     def _disassemble(self, lineno_width=3, mark_as_current=False):
         """Format instruction details for inclusion in disassembly output
 
@@ -254,15 +491,11 @@ def get_instructions(x, first_line=None):
     the disassembled code object.
     """
     co = _get_code_object(x)
-    cell_names = co.co_cellvars + co.co_freevars
-    linestarts = dict(findlinestarts(co))
     if first_line is not None:
         line_offset = first_line - co.co_firstlineno
     else:
         line_offset = 0
-    return _get_instructions_bytes(co.co_code, co.co_varnames, co.co_names,
-                                   co.co_consts, cell_names, linestarts,
-                                   line_offset)
+    return _get_decoded(co).get_instructions(line_offset)
 
 
 def _get_const_info(const_index, const_list):
@@ -271,11 +504,12 @@ def _get_const_info(const_index, const_list):
        Returns the dereferenced constant and its repr if the constant
        list is defined.
        Otherwise returns the constant index and its repr().
+       The repr is a _LazyRepr which is only computed when first needed.
     """
     argval = const_index
     if const_list is not None:
         argval = const_list[const_index]
-    return argval, repr(argval)
+    return argval, _LazyRepr(argval)
 
 
 def _get_name_info(name_index, name_list):
@@ -304,132 +538,349 @@ def _get_instructions_bytes(code, varnames=None, names=None, constants=None,
     arguments.
 
     """
+    ops, labels = _decode_bytes(code)
+    instructions = _resolve_instructions(ops, labels, varnames, names,
+                                         constants, cells, linestarts,
+                                         line_offset)
+    if _stats is not None:
+        instructions = _stats.iterate(instructions, 'resolve', 'instructions')
+    return instructions
 
-    labels = findlabels(code)
-    extended_arg = 0
-    starts_line = None
 
-    n = len(code)
-    i = 0
-    extended_arg = 0
-    free = None
-    while i < n:
-        c = code[i]
-        op = ord(c)
-        offset = i
+def _resolve_instructions(ops, labels, varnames=None, names=None,
+                          constants=None, cells=None, linestarts=None,
+                          line_offset=0):
+    """Generate Instructions for decoded (offset, opcode, arg) triples.
+
+    *labels* is the set of jump target offsets; the remaining arguments are
+    as for _get_instructions_bytes().
+    """
+    arg_kinds = _arg_kinds
+    opnames = _opnames
+    starts_line = None
+    for offset, op, arg in ops:
         if linestarts is not None:
-            starts_line = linestarts.get(i, None)
+            starts_line = linestarts.get(offset, None)
             if starts_line is not None:
                 starts_line += line_offset
-        is_jump_target = i in labels
-        i = i + 1
-        arg = None
+        is_jump_target = offset in labels
         argval = None
         argrepr = ''
-        if op >= HAVE_ARGUMENT:
-            arg = ord(code[i]) + ord(code[i + 1]) * 256 + extended_arg
-            extended_arg = 0
-            i = i + 2
-            if op == EXTENDED_ARG:
-                extended_arg = arg * 65536L
+        if arg is not None:
             argval = arg
-            if op in hasconst:
+            kind = arg_kinds[op]
+            if kind == _ARG_PLAIN:
+                pass
+            elif kind == _ARG_CONST:
                 argval, argrepr = _get_const_info(arg, constants)
-            elif op in hasname:
+            elif kind == _ARG_NAME:
                 argval, argrepr = _get_name_info(arg, names)
-            elif op in hasjrel:
-                argval = i + arg
+            elif kind == _ARG_JREL:
+                argval = offset + 3 + arg
                 argrepr = "to " + repr(argval)
-            elif op in haslocal:
+            elif kind == _ARG_LOCAL:
                 argval, argrepr = _get_name_info(arg, varnames)
-            elif op in hascompare:
+            elif kind == _ARG_COMPARE:
                 argval = cmp_op[arg]
                 argrepr = argval
-            elif op in hasfree:
+            elif kind == _ARG_FREE:
                 argval, argrepr = _get_name_info(arg, cells)
-            elif op in hasnargs:
-                argrepr = "%d positional, %d keyword pair" % (ord(code[i-2]), ord(code[i-1]))
+            elif kind == _ARG_NARGS:
+                argrepr = "%d positional, %d keyword pair" % (
+                    arg & 0xff, (arg >> 8) & 0xff)
 
-        yield Instruction(opname[op], op,
+        yield Instruction(opnames[op], op,
                           arg, argval, argrepr,
                           offset, starts_line, is_jump_target)
 
 
 def disassemble(co, lasti=-1, file=None):
     """Disassemble a code object."""
-    cell_names = co.co_cellvars + co.co_freevars
-    linestarts = dict(findlinestarts(co))
-    _disassemble_bytes(co.co_code, lasti, co.co_varnames, co.co_names,
-                       co.co_consts, cell_names, linestarts, file=file)
+    _disassemble_instructions(_get_decoded(co).get_instructions(), lasti,
+                              file=file)
+
+
+def _disassemble_recursive(co, file=None, depth=None, seen=None):
+    """Disassemble a code object and the code objects nested in its
+    constants, up to *depth* levels deep (None for no limit).
+    """
+    if seen is None:
+        seen = set()
+    disassemble(co, file=file)
+    if depth is None or depth > 0:
+        if depth is not None:
+            depth = depth - 1
+        for x in co.co_consts:
+            if hasattr(x, 'co_code') and id(x) not in seen:
+                seen.add(id(x))
+                print(file=file)
+                print("Disassembly of %r:" % (x,), file=file)
+                _disassemble_recursive(x, file, depth, seen)
 
 
 def _disassemble_bytes(code, lasti=-1, varnames=None, names=None,
                        constants=None, cells=None, linestarts=None,
                        file=None, line_offset=0):
+    instructions = _get_instructions_bytes(code, varnames, names,
+                                           constants, cells, linestarts,
+                                           line_offset=line_offset)
     # Omit the line number column entirely if we have no line number info
-    show_lineno = linestarts is not None
+    _disassemble_instructions(instructions, lasti, linestarts is not None,
+                              file=file)
+
+
+def _disassemble_instructions(instructions, lasti=-1, show_lineno=True,
+                              file=None):
+    """Print already decoded instructions as a disassembly listing."""
+    lines = _format_instructions(instructions, lasti, show_lineno)
+    if _stats is not None:
+        lines = _stats.iterate(lines, 'format', None)
+    _write_lines(lines, file=file)
+
+
+def _format_instructions(instructions, lasti=-1, show_lineno=True):
+    """Generate the lines of a disassembly listing, without line endings."""
     # TODO?: Adjust width upwards if max(linestarts.values()) >= 1000?
     lineno_width = 3 if show_lineno else 0
-    for instr in _get_instructions_bytes(code, varnames, names,
-                                         constants, cells, linestarts,
-                                         line_offset=line_offset):
+    for instr in instructions:
         new_source_line = (show_lineno and
                            instr.starts_line is not None and
                            instr.offset > 0)
         if new_source_line:
-            print(file=file)
+            yield ''
         is_current_instr = instr.offset == lasti
-        print(instr._disassemble(lineno_width, is_current_instr), file=file)
+        yield instr._disassemble(lineno_width, is_current_instr)
 
 
-def _disassemble_str(source, file=None):
-    """Compile the source string, then disassemble the code object."""
-    disassemble(_try_compile(source, '<dis>'), file=file)
+# Number of lines joined into a single write() by _write_lines
+_WRITE_CHUNK_LINES = 4096
+
+
+def _write_lines(lines, file=None):
+    """Write *lines* to *file* (default sys.stdout), each followed by a
+    newline, joining them into chunks rather than writing line by line.
+    """
+    if file is None:
+        file = sys.stdout
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= _WRITE_CHUNK_LINES:
+            _write_chunk(chunk, file)
+            del chunk[:]
+    if chunk:
+        _write_chunk(chunk, file)
+
+
+def _write_chunk(chunk, file):
+    """Write the list of lines *chunk* to *file* with a single write()."""
+    stats = _stats
+    if stats is not None:
+        stats.counters['lines_written'] += len(chunk)
+        start = _timer()
+    chunk.append('')
+    file.write('\n'.join(chunk))
+    if stats is not None:
+        stats.timers['write'] += _timer() - start
+
+
+# Control characters which do not occur in source code, but do in bytecode
+_CONTROL_CHARS = ''.join(chr(c) for c in range(32) + [127]
+                         if chr(c) not in '\t\n\v\f\r')
+
+
+def _disassemble_str(source, file=None, depth=0):
+    """Compile the source string, then disassemble the code object.
+
+    A string which cannot be compiled because it contains null bytes, or
+    which is not valid source and contains other control characters, is
+    raw bytecode, and is disassembled as such. Bytecode which happens to be
+    valid source, such as 'S', is compiled; pass a bytearray to be sure it
+    is taken as bytecode.
+    """
+    try:
+        co = _try_compile(source, '<dis>')
+    except SyntaxError:
+        if len(source.translate(None, _CONTROL_CHARS)) == len(source):
+            raise
+        co = source
+    if hasattr(co, 'co_code'):
+        _disassemble_recursive(co, file=file, depth=depth)
+    else:
+        _disassemble_bytes(co, file=file)
 
 
 disco = disassemble  # XXX For backwards compatibility
 
 
-def findlabels(code):
-    """Detect all offsets in a byte code which are jump targets.
+def _byte_view(code):
+    """Return *code* as a sequence of integers which can be indexed directly.
 
-    Return the list of offsets.
+    *code* may be a str or any object supporting the buffer protocol, such
+    as a bytearray, buffer or memoryview. A bytearray is used as is; other
+    objects are converted once, since indexing them yields one character
+    strings.
+    """
+    if isinstance(code, bytearray):
+        return code
+    return bytearray(code)
+
+
+@_timed('decode')
+def _decode_bytes(code):
+    """Decode a bytecode string or buffer in a single pass.
 
+    Returns a list of (offset, opcode, arg) triples, where arg is None for
+    opcodes without an argument and already includes any EXTENDED_ARG
+    prefix, together with the set of offsets which are jump targets.
+
+    """
+    code = _byte_view(code)
+    if _stats is not None:
+        _stats.counters['bytes_decoded'] += len(code)
+    ops = []
+    append = ops.append
+    labels = set()
+    add_label = labels.add
+    jrel = _hasjrel
+    jabs = _hasjabs
+    n = len(code)
+    i = 0
+    extended_arg = 0
+    while i < n:
+        op = code[i]
+        if op < HAVE_ARGUMENT:
+            append((i, op, None))
+            i = i + 1
+            continue
+        arg = code[i + 1] + (code[i + 2] << 8) + extended_arg
+        extended_arg = 0
+        append((i, op, arg))
+        i = i + 3
+        if op == EXTENDED_ARG:
+            extended_arg = arg << 16
+        elif op in jrel:
+            add_label(i + arg)
+        elif op in jabs:
+            add_label(arg)
+    return ops, labels
+
+
+def _scan_labels(code):
+    """Return the set of jump target offsets of *code*.
+
+    This is the jump-only counterpart of _decode_bytes(), for callers which
+    need the labels but not the instructions. Only the arguments of jumps
+    and EXTENDED_ARG prefixes are read, and no list of the instructions is
+    built.
     """
-    labels = []
+    code = _byte_view(code)
+    if _stats is not None:
+        _stats.counters['bytes_decoded'] += len(code)
+    labels = set()
+    add_label = labels.add
+    jrel = _hasjrel
+    jabs = _hasjabs
     n = len(code)
     i = 0
+    extended_arg = 0
     while i < n:
-        c = code[i]
-        op = ord(c)
-        i = i+1
-        if op >= HAVE_ARGUMENT:
-            oparg = ord(code[i]) + ord(code[i+1])*256
-            i = i+2
-            label = -1
-            if op in hasjrel:
-                label = i+oparg
-            elif op in hasjabs:
-                label = oparg
-            if label >= 0:
-                if label not in labels:
-                    labels.append(label)
+        op = code[i]
+        if op < HAVE_ARGUMENT:
+            i = i + 1
+        elif op in jrel:
+            i = i + 3
+            add_label(i + code[i - 2] + (code[i - 1] << 8) + extended_arg)
+            extended_arg = 0
+        elif op in jabs:
+            add_label(code[i + 1] + (code[i + 2] << 8) + extended_arg)
+            extended_arg = 0
+            i = i + 3
+        elif op == EXTENDED_ARG:
+            extended_arg = (code[i + 1] + (code[i + 2] << 8) +
+                            extended_arg) << 16
+            i = i + 3
+        else:
+            extended_arg = 0
+            i = i + 3
     return labels
 
 
+def _unpack_opargs(code):
+    """Generate the (offset, opcode, arg) triples of *code* one at a time.
+
+    This is the lazy counterpart of _decode_bytes(), for callers which may
+    stop before the end of the code. It does not collect jump targets.
+    """
+    code = _byte_view(code)
+    n = len(code)
+    i = 0
+    extended_arg = 0
+    while i < n:
+        op = code[i]
+        if op < HAVE_ARGUMENT:
+            yield (i, op, None)
+            i = i + 1
+            continue
+        arg = code[i + 1] + (code[i + 2] << 8) + extended_arg
+        extended_arg = arg << 16 if op == EXTENDED_ARG else 0
+        yield (i, op, arg)
+        i = i + 3
+
+
+def _window_ops(code, around=None, context=0, start=None, stop=None):
+    """Return the (offset, opcode, arg) triples of a window onto *code*.
+
+    With *around*, the window is the instruction containing that offset and
+    up to *context* instructions either side of it. Otherwise it is the
+    instructions whose offsets lie in [*start*, *stop*). Decoding stops as
+    soon as the window is complete.
+    """
+    ops = _unpack_opargs(code)
+    if around is None:
+        if start is None:
+            start = 0
+        if stop is not None:
+            ops = itertools.takewhile(lambda entry: entry[0] < stop, ops)
+        return [entry for entry in ops if entry[0] >= start]
+    before = collections.deque(maxlen=context)
+    for entry in ops:
+        offset, op, arg = entry
+        if offset + (1 if arg is None else 3) > around:
+            break
+        before.append(entry)
+    else:
+        return []
+    window = list(before)
+    window.append(entry)
+    window.extend(itertools.islice(ops, context))
+    return window
+
+
+@_timed('labels')
+def findlabels(code):
+    """Detect all offsets in a byte code which are jump targets.
+
+    Return the sorted list of offsets.
+
+    """
+    return sorted(_scan_labels(code))
+
+
 def findlinestarts(code):
     """Find the offsets in a byte code which are start of lines in the source.
 
     Generate pairs (offset, lineno) as described in Python/compile.c.
 
     """
-    byte_increments = [ord(c) for c in code.co_lnotab[0::2]]
-    line_increments = [ord(c) for c in code.co_lnotab[1::2]]
+    lnotab = bytearray(code.co_lnotab)
 
     lastlineno = None
     lineno = code.co_firstlineno
     addr = 0
-    for byte_incr, line_incr in zip(byte_increments, line_increments):
+    for i in xrange(0, len(lnotab) - 1, 2):
+        byte_incr = lnotab[i]
+        line_incr = lnotab[i + 1]
         if byte_incr:
             if lineno != lastlineno:
                 yield (addr, lineno)
@@ -440,6 +891,430 @@ def findlinestarts(code):
         yield (addr, lineno)
 
 
+class _DecodedCode(object):
+    """Details derived from a code object by decoding it.
+
+    Instances held by the code cache keep their decoded instruction list
+    and code_info() text, so later requests for the same code object are
+    served without decoding again.
+    """
+
+    __slots__ = ('codeobj', 'code', 'cell_names', 'linestarts', 'cached',
+                 '_instructions', '_info', '_line_table', '_labels')
+
+    def __init__(self, co, cached=False):
+        self.codeobj = co
+        self.code = _byte_view(co.co_code)
+        self.cell_names = co.co_cellvars + co.co_freevars
+        stats = _stats
+        if stats is not None:
+            stats.counters['code_objects'] += 1
+            start = _timer()
+        self.linestarts = dict(findlinestarts(co))
+        if stats is not None:
+            stats.timers['linestarts'] += _timer() - start
+        self.cached = cached
+        self._instructions = None
+        self._info = None
+        self._line_table = None
+        self._labels = None
+
+    def _decode(self, line_offset=0):
+        if _disk_cache is not None:
+            return iter(_disk_cache.get_instructions(self, line_offset))
+        return self._decode_instructions(line_offset)
+
+    def _decode_instructions(self, line_offset=0):
+        co = self.codeobj
+        return _get_instructions_bytes(self.code, co.co_varnames, co.co_names,
+                                       co.co_consts, self.cell_names,
+                                       self.linestarts, line_offset)
+
+    def get_instructions(self, line_offset=0):
+        """Return an iterator over the instructions of the code object."""
+        if not self.cached or line_offset:
+            return self._decode(line_offset)
+        if self._instructions is None:
+            self._instructions = list(self._decode())
+        return iter(self._instructions)
+
+    @_timed('labels')
+    def labels(self):
+        """Return the set of jump target offsets of the code object."""
+        if self._labels is None:
+            self._labels = _scan_labels(self.code)
+        return self._labels
+
+    def line_table(self):
+        """Return the sorted line table of the code object.
+
+        This is a tuple of four arrays: the line start offsets in ascending
+        order with the line each starts, and the same pairs ordered by
+        line instead, for binary searching in either direction.
+        """
+        if self._line_table is None:
+            starts = sorted(self.linestarts.items())
+            by_line = sorted((line, offset) for offset, line in starts)
+            self._line_table = (array.array('l', [o for o, _ in starts]),
+                                array.array('l', [l for _, l in starts]),
+                                array.array('l', [l for l, _ in by_line]),
+                                array.array('l', [o for _, o in by_line]))
+        return self._line_table
+
+    def info(self):
+        """Return the code_info() text for the code object."""
+        if self._info is None:
+            if _disk_cache is not None:
+                info = _disk_cache.info(self)
+            else:
+                info = _format_code_info(self.codeobj)
+            if not self.cached:
+                return info
+            self._info = info
+        return self._info
+
+
+CacheInfo = collections.namedtuple("CacheInfo", "hits misses maxsize currsize")
+
+
+class _CodeCache(object):
+    """LRU cache of _DecodedCode entries keyed on code object identity.
+
+    Code objects cannot be weakly referenced in Python 2, so each entry
+    keeps its code object alive. That also guarantees the id() used as
+    key cannot be reused while the entry exists. Entries are released as
+    soon as they fall off the end of the LRU order or the cache is
+    cleared.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def get(self, co):
+        key = id(co)
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            entry = _DecodedCode(co, cached=True)
+            if len(self._entries) >= self.maxsize:
+                self._entries.popitem(last=False)
+        else:
+            self.hits += 1
+        self._entries[key] = entry
+        return entry
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize,
+                         len(self._entries))
+
+
+_code_cache = None
+
+
+def enable_cache(maxsize=256):
+    """Cache decoded code objects across calls, keeping at most *maxsize*.
+
+    Once enabled, get_instructions(), code_info(), dis() and Bytecode reuse
+    the line starts, instructions and code_info() text of recently seen
+    code objects. Re-enabling replaces the existing cache.
+    """
+    global _code_cache
+    if maxsize < 1:
+        raise ValueError("maxsize must be at least 1")
+    _code_cache = _CodeCache(maxsize)
+
+
+def disable_cache():
+    """Disable and discard the decoded code object cache."""
+    global _code_cache
+    _code_cache = None
+
+
+def cache_clear():
+    """Discard all entries and counters of the decoded code object cache."""
+    if _code_cache is not None:
+        enable_cache(_code_cache.maxsize)
+
+
+def cache_info():
+    """Return a CacheInfo of hits, misses, maxsize and currsize.
+
+    Returns None if the cache is not enabled.
+    """
+    if _code_cache is None:
+        return None
+    return _code_cache.info()
+
+
+# Bump when the layout of disk cache entries changes, so that stale
+# entries are ignored rather than misread.
+_DISK_CACHE_VERSION = 1
+_DISK_CACHE_SUFFIX = '.discache'
+# Eviction trims the directory to this fraction of its limit, so that the
+# next few stores do not each trigger another scan of the directory.
+_DISK_CACHE_LOW_WATER = 0.9
+
+
+def _code_digest(co):
+    """Return a stable hex digest of everything the decoded output of *co*
+    depends on: co_code, co_consts, co_names and co_lnotab, together with
+    the variable names and header fields shown by code_info().
+    """
+    fields = (co.co_code, co.co_consts, co.co_names, co.co_lnotab,
+              co.co_varnames, co.co_cellvars, co.co_freevars, co.co_name,
+              co.co_filename, co.co_firstlineno, co.co_argcount,
+              co.co_nlocals, co.co_stacksize, co.co_flags)
+    # Version 0 does not share interned strings, whose references would
+    # otherwise depend on the interning state of this process.
+    import hashlib
+    return hashlib.sha1(marshal.dumps(fields, 0)).hexdigest()
+
+
+def _instruction_row(instr, line_offset):
+    """Return the disk cache row of *instr*, leaving out any constant."""
+    starts_line = instr.starts_line
+    if starts_line is not None:
+        starts_line -= line_offset
+    if _arg_kinds[instr.opcode] == _ARG_CONST and instr.arg is not None:
+        return (instr.opcode, instr.arg, None, None, instr.offset,
+                starts_line, instr.is_jump_target)
+    return (instr.opcode, instr.arg, instr.argval, instr.argrepr,
+            instr.offset, starts_line, instr.is_jump_target)
+
+
+class _DiskCache(object):
+    """Size bounded cache of decoded instructions and code_info() text in a
+    directory, shared between processes and runs.
+
+    Each entry is a marshalled file named after the digest of the code
+    object and the kind of data held. Instructions are stored as rows
+    without their constants, which are taken from the code object again
+    when the entry is loaded. Files are written under a temporary name
+    and renamed into place, so concurrent writers never expose partial
+    entries. Once the directory grows beyond *maxbytes*, the least
+    recently used entries are removed until it is back under 90% of it.
+    """
+
+    def __init__(self, directory, maxbytes):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.size = sum(size for _, size, _ in self._entries())
+        if self.size > maxbytes:
+            self._evict()
+
+    def _entries(self):
+        """Return (mtime, size, path) for each entry in the directory."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(_DISK_CACHE_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:  # Evicted by another process
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _path(self, decoded, kind):
+        return os.path.join(self.directory, '%s-%s%s' % (
+            _code_digest(decoded.codeobj), kind, _DISK_CACHE_SUFFIX))
+
+    def _load(self, path):
+        try:
+            with open(path, 'rb') as infile:
+                version, data = marshal.loads(infile.read())
+        except (IOError, EOFError, ValueError, TypeError):
+            self.misses += 1
+            return None
+        if version != _DISK_CACHE_VERSION:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def _store(self, path, data):
+        data = marshal.dumps((_DISK_CACHE_VERSION, data))
+        import tempfile
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as outfile:
+                outfile.write(data)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        self.size += len(data)
+        if self.size > self.maxbytes:
+            self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        self.size = sum(size for _, size, _ in entries)
+        limit = self.maxbytes * _DISK_CACHE_LOW_WATER
+        for _, size, path in entries:
+            if self.size <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+
+    def get_instructions(self, decoded, line_offset=0):
+        """Return a list of the instructions of *decoded*, a _DecodedCode."""
+        try:
+            path = self._path(decoded, 'instructions')
+        except ValueError:  # Constants marshal cannot write, so not cached
+            return list(decoded._decode_instructions(line_offset))
+        rows = self._load(path)
+        if rows is None:
+            instructions = list(decoded._decode_instructions(line_offset))
+            self._store(path, [_instruction_row(instr, line_offset)
+                               for instr in instructions])
+            return instructions
+        consts = decoded.codeobj.co_consts
+        arg_kinds = _arg_kinds
+        opnames = _opnames
+        instructions = []
+        append = instructions.append
+        for (op, arg, argval, argrepr, offset, starts_line,
+             is_jump_target) in rows:
+            if arg_kinds[op] == _ARG_CONST and arg is not None:
+                argval = consts[arg]
+                argrepr = _LazyRepr(argval)
+            if starts_line is not None:
+                starts_line += line_offset
+            append(Instruction(opnames[op], op, arg, argval, argrepr, offset,
+                               starts_line, is_jump_target))
+        return instructions
+
+    def info(self, decoded):
+        """Return the code_info() text of *decoded*, a _DecodedCode."""
+        try:
+            path = self._path(decoded, 'info')
+        except ValueError:  # Constants marshal cannot write, so not cached
+            return _format_code_info(decoded.codeobj)
+        info = self._load(path)
+        if info is None:
+            info = _format_code_info(decoded.codeobj)
+            self._store(path, info)
+        return info
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.maxbytes, self.size)
+
+
+_disk_cache = None
+
+
+def enable_disk_cache(directory, maxbytes=64 * 1024 * 1024):
+    """Keep decoded instructions and code_info() text in *directory*.
+
+    Entries are keyed by a hash of the content of each code object, so they
+    stay valid across processes and runs for as long as the code does not
+    change; the directory is trimmed to about *maxbytes* by discarding the
+    least recently used entries. The disk cache is consulted before code
+    objects are decoded, and works with or without enable_cache().
+    """
+    global _disk_cache
+    if maxbytes < 1:
+        raise ValueError("maxbytes must be at least 1")
+    _disk_cache = _DiskCache(directory, maxbytes)
+
+
+def disable_disk_cache():
+    """Stop using the disk cache. Its directory is left in place."""
+    global _disk_cache
+    _disk_cache = None
+
+
+def disk_cache_info():
+    """Return a CacheInfo of hits, misses, maxsize and currsize in bytes for
+    the disk cache, or None if it is not enabled.
+    """
+    if _disk_cache is None:
+        return None
+    return _disk_cache.cache_info()
+
+
+def _get_decoded(co):
+    """Return the _DecodedCode for *co*, from the cache if it is enabled."""
+    if _code_cache is None:
+        return _DecodedCode(co)
+    return _code_cache.get(co)
+
+
+class InstructionColumns(object):
+    """Struct-of-arrays view of the instructions of a code object.
+
+    Each of the columns opcode, arg, offset, line and is_jump_target is an
+    array.array with one entry per instruction. arg is -1 for opcodes
+    without an argument, and line is the source line each instruction
+    belongs to (-1 before the first line start). Arguments index into the
+    side tables constants, names, varnames and cells, exactly as they
+    index into the code object.
+    """
+
+    typecodes = (('opcode', 'B'), ('arg', 'l'), ('offset', 'l'),
+                 ('line', 'l'), ('is_jump_target', 'B'))
+
+    def __init__(self, co, code, linestarts, cells, line_offset=0):
+        self.constants = co.co_consts
+        self.names = co.co_names
+        self.varnames = co.co_varnames
+        self.cells = cells
+        ops, labels = _decode_bytes(code)
+        self.opcode = opcodes = array.array('B')
+        self.arg = args = array.array('l')
+        self.offset = offsets = array.array('l')
+        self.line = lines = array.array('l')
+        self.is_jump_target = jump_targets = array.array('B')
+        line = -1
+        for offset, op, arg in ops:
+            starts_line = linestarts.get(offset)
+            if starts_line is not None:
+                line = starts_line + line_offset
+            opcodes.append(op)
+            args.append(-1 if arg is None else arg)
+            offsets.append(offset)
+            lines.append(line)
+            jump_targets.append(offset in labels)
+
+    def __len__(self):
+        return len(self.opcode)
+
+    def to_numpy(self):
+        """Return a dict of the columns as NumPy arrays.
+
+        The arrays share memory with the columns rather than copying them.
+        Raises ImportError if NumPy is not installed.
+        """
+        import numpy
+        columns = {}
+        for name, typecode in self.typecodes:
+            column = getattr(self, name)
+            if column:
+                columns[name] = numpy.frombuffer(column, typecode)
+            else:
+                columns[name] = numpy.empty(0, typecode)
+        return columns
+
+
 class Bytecode:
     """The bytecode operations of a piece of code
 
@@ -447,9 +1322,13 @@ class Bytecode:
     (as returned by compile()).
 
     Iterating over this yields the bytecode operations as Instruction instances.
+
+    The instructions are decoded once, on first use, and kept for later
+    iteration, indexing, len() and dis(). Pass cache=False for one-shot
+    streaming use, in which case every access decodes the code afresh.
     """
 
-    def __init__(self, x, first_line=None, current_offset=None):
+    def __init__(self, x, first_line=None, current_offset=None, cache=True):
         self.codeobj = co = _get_code_object(x)
         if first_line is None:
             self.first_line = co.co_firstlineno
@@ -457,17 +1336,36 @@ class Bytecode:
         else:
             self.first_line = first_line
             self._line_offset = first_line - co.co_firstlineno
-        self._cell_names = co.co_cellvars + co.co_freevars
-        self._linestarts = dict(findlinestarts(co))
+        self._decoded = _get_decoded(co)
+        self._cell_names = self._decoded.cell_names
+        self._linestarts = self._decoded.linestarts
         self._original_object = x
         self.current_offset = current_offset
+        self._cache = cache
+        self._instructions = None
+
+    def _decode(self):
+        return self._decoded.get_instructions(self._line_offset)
+
+    def _get_instructions(self):
+        """Return the decoded instructions as a list, caching if enabled."""
+        if self._instructions is not None:
+            return self._instructions
+        instructions = list(self._decode())
+        if self._cache:
+            self._instructions = instructions
+        return instructions
 
     def __iter__(self):
-        co = self.codeobj
-        return _get_instructions_bytes(co.co_code, co.co_varnames, co.co_names,
-                                       co.co_consts, self._cell_names,
-                                       self._linestarts,
-                                       line_offset=self._line_offset)
+        if self._cache:
+            return iter(self._get_instructions())
+        return self._decode()
+
+    def __len__(self):
+        return len(self._get_instructions())
+
+    def __getitem__(self, index):
+        return self._get_instructions()[index]
 
     def __repr__(self):
         return "{}({!r})".format(self.__class__.__name__,
@@ -482,38 +1380,1311 @@ class Bytecode:
 
     def info(self):
         """Return formatted information about the code object."""
-        return _format_code_info(self.codeobj)
+        return self._decoded.info()
 
-    def dis(self):
-        """Return a formatted view of the bytecode operations."""
-        co = self.codeobj
+    def line_for_offset(self, offset):
+        """Return the source line of the instruction containing *offset*.
+
+        *offset* may fall anywhere in the bytecode (such as a frame's
+        f_lasti). Returns None if it precedes the first line start.
+        """
+        offsets, lines = self._decoded.line_table()[:2]
+        i = bisect.bisect_right(offsets, offset) - 1
+        if i < 0:
+            return None
+        return lines[i] + self._line_offset
+
+    def offsets_for_line(self, line):
+        """Return the sorted offsets at which code for source *line* starts."""
+        lines, offsets = self._decoded.line_table()[2:]
+        line -= self._line_offset
+        lo = bisect.bisect_left(lines, line)
+        hi = bisect.bisect_right(lines, line, lo)
+        return offsets[lo:hi].tolist()
+
+    def columns(self):
+        """Return the instructions as an InstructionColumns table."""
+        decoded = self._decoded
+        return InstructionColumns(self.codeobj, decoded.code,
+                                  decoded.linestarts, decoded.cell_names,
+                                  self._line_offset)
+
+    def dis(self, around=None, context=5, start=None, stop=None):
+        """Return a formatted view of the bytecode operations.
+
+        If *around* is given, only the instruction containing that offset
+        and up to *context* instructions either side of it are shown.
+        Otherwise *start* and *stop* may limit the view to the instructions
+        with offsets in [start, stop). Either way, only the window is
+        decoded into instructions, though finding the jump targets within
+        it still means scanning the whole code for jumps.
+        """
         if self.current_offset is not None:
             offset = self.current_offset
         else:
             offset = -1
-        with contextlib.closing(StringIO.StringIO()) as output:
-            _disassemble_bytes(co.co_code, varnames=co.co_varnames,
-                               names=co.co_names, constants=co.co_consts,
-                               cells=self._cell_names,
-                               linestarts=self._linestarts,
-                               line_offset=self._line_offset,
-                               file=output,
-                               lasti=offset)
-            return output.getvalue()
+        if around is None and start is None and stop is None:
+            instructions = iter(self)
+        else:
+            instructions = self._window(around, context, start, stop)
+        lines = list(_format_instructions(instructions, lasti=offset))
+        if lines and not lines[0]:
+            del lines[0]
+        lines.append('')
+        return '\n'.join(lines)
+
+    def _window(self, around, context, start, stop):
+        """Return an iterator over a window of the instructions."""
+        if around is not None and not 0 <= around < len(self._decoded.code):
+            return iter([])
+        if self._instructions is not None:
+            offsets = [instr.offset for instr in self._instructions]
+            if around is not None:
+                i = bisect.bisect_right(offsets, around) - 1
+                lo, hi = max(i - context, 0), i + context + 1
+            else:
+                lo = bisect.bisect_left(offsets, start or 0)
+                hi = len(offsets) if stop is None \
+                    else bisect.bisect_left(offsets, stop)
+            return iter(self._instructions[lo:hi])
+        decoded = self._decoded
+        co = self.codeobj
+        ops = _window_ops(decoded.code, around, context, start, stop)
+        return _resolve_instructions(ops, decoded.labels(), co.co_varnames,
+                                     co.co_names, co.co_consts,
+                                     self._cell_names, self._linestarts,
+                                     self._line_offset)
+
+
+# Opcodes which end a basic block, grouped by the edges leaving the block
+_UNCONDITIONAL_JUMPS = frozenset(opmap[name] for name in (
+    'JUMP_FORWARD', 'JUMP_ABSOLUTE', 'CONTINUE_LOOP'))
+_CONDITIONAL_JUMPS = frozenset(opmap[name] for name in (
+    'POP_JUMP_IF_FALSE', 'POP_JUMP_IF_TRUE', 'JUMP_IF_FALSE_OR_POP',
+    'JUMP_IF_TRUE_OR_POP', 'FOR_ITER'))
+_SCOPE_EXITS = frozenset(opmap[name] for name in (
+    'RETURN_VALUE', 'RAISE_VARARGS'))
+_HANDLER_SETUPS = frozenset(opmap[name] for name in (
+    'SETUP_EXCEPT', 'SETUP_FINALLY', 'SETUP_WITH'))
+_SETUP_LOOP = opmap['SETUP_LOOP']
+_BREAK_LOOP = opmap['BREAK_LOOP']
+_BLOCK_ENDS = (_UNCONDITIONAL_JUMPS | _CONDITIONAL_JUMPS | _SCOPE_EXITS |
+               frozenset([_BREAK_LOOP]))
+
+FALLTHROUGH = 'fallthrough'
+CONDITIONAL = 'conditional'
+UNCONDITIONAL = 'unconditional'
+EXCEPTION = 'exception'
+
+
+class BasicBlock(object):
+    """A straight-line run of instructions in a ControlFlowGraph
+
+       Attributes:
+         index - position of the block in ControlFlowGraph.blocks
+         instructions - the Instructions of the block, in order
+         successors - list of (block, kind) pairs for the edges leaving it
+         predecessors - list of (block, kind) pairs for the edges entering it
+         idom - immediate dominator, None for the entry and unreachable blocks
+
+       Edge kinds are FALLTHROUGH, CONDITIONAL (the taken branch of a
+       conditional jump or FOR_ITER), UNCONDITIONAL (jumps, CONTINUE_LOOP and
+       BREAK_LOOP) and EXCEPTION (to the handler of an enclosing
+       SETUP_EXCEPT, SETUP_FINALLY or SETUP_WITH).
+    """
+
+    __slots__ = ('index', 'instructions', 'successors', 'predecessors',
+                 'idom')
+
+    def __init__(self, index, instructions):
+        self.index = index
+        self.instructions = instructions
+        self.successors = []
+        self.predecessors = []
+        self.idom = None
+
+    @property
+    def start(self):
+        """Offset of the first instruction of the block."""
+        return self.instructions[0].offset
+
+    @property
+    def end(self):
+        """Offset just past the last instruction of the block."""
+        last = self.instructions[-1]
+        return last.offset + (1 if last.arg is None else 3)
+
+    def __repr__(self):
+        return "<BasicBlock %d [%d, %d)>" % (self.index, self.start, self.end)
+
+
+class ControlFlowGraph(object):
+    """The basic blocks of a piece of code and the edges between them
+
+    Instantiate this with a Bytecode, or anything Bytecode accepts. The
+    graph is built in a single pass over the instructions; dominators are
+    computed on first use.
+    """
+
+    def __init__(self, x):
+        if not isinstance(x, Bytecode):
+            x = Bytecode(x)
+        self.bytecode = x
+        self.blocks = []
+        self._by_offset = {}
+        self._dominators_done = False
+        self._build(list(x))
+
+    @property
+    def entry(self):
+        """The block execution starts in, None for empty code."""
+        return self.blocks[0] if self.blocks else None
+
+    def block_at(self, offset):
+        """Return the block which starts at *offset*."""
+        return self._by_offset[offset]
+
+    def _build(self, instructions):
+        # Split into blocks at jump targets and after block ending opcodes
+        # while recording, for each block, the instruction which ends it, the
+        # innermost exception handler protecting it and the loop BREAK_LOOP
+        # leaves. Setups are matched to the code they enclose textually,
+        # which is how the compiler lays them out.
+        handlers = []
+        loops = []
+        pending = []
+        current = None
+        for instr in instructions:
+            offset = instr.offset
+            while handlers and handlers[-1] <= offset:
+                handlers.pop()
+            while loops and loops[-1] <= offset:
+                loops.pop()
+            if current is None or instr.is_jump_target:
+                current = BasicBlock(len(self.blocks), [])
+                self.blocks.append(current)
+                self._by_offset[offset] = current
+                pending.append([current, None, set()])
+            current.instructions.append(instr)
+            if handlers:
+                pending[-1][2].add(handlers[-1])
+            op = instr.opcode
+            if op in _HANDLER_SETUPS:
+                handlers.append(instr.argval)
+            elif op == _SETUP_LOOP:
+                loops.append(instr.argval)
+            elif op == _BREAK_LOOP:
+                pending[-1][1] = loops[-1] if loops else None
+                current = None
+            elif op in _BLOCK_ENDS:
+                current = None
+        for block, break_target, handler_offsets in pending:
+            last = block.instructions[-1]
+            op = last.opcode
+            if op in _UNCONDITIONAL_JUMPS:
+                self._add_edge(block, last.argval, UNCONDITIONAL)
+            elif op == _BREAK_LOOP:
+                if break_target is not None:
+                    self._add_edge(block, break_target, UNCONDITIONAL)
+            elif op not in _SCOPE_EXITS:
+                if op in _CONDITIONAL_JUMPS:
+                    self._add_edge(block, last.argval, CONDITIONAL)
+                if block.index + 1 < len(self.blocks):
+                    self._add_edge(block, self.blocks[block.index + 1].start,
+                                   FALLTHROUGH)
+            for handler in sorted(handler_offsets):
+                self._add_edge(block, handler, EXCEPTION)
+
+    def _add_edge(self, block, target_offset, kind):
+        target = self._by_offset.get(target_offset)
+        if target is not None:
+            block.successors.append((target, kind))
+            target.predecessors.append((block, kind))
+
+    def _reverse_postorder(self):
+        """Return the blocks reachable from the entry in reverse postorder."""
+        order = []
+        visited = set([0])
+        stack = [(self.entry, iter(self.entry.successors))]
+        while stack:
+            block, successors = stack[-1]
+            for successor, _ in successors:
+                if successor.index not in visited:
+                    visited.add(successor.index)
+                    stack.append((successor, iter(successor.successors)))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        order.reverse()
+        return order
+
+    def _compute_dominators(self):
+        # Cooper, Harvey & Kennedy, "A Simple, Fast Dominance Algorithm"
+        if self._dominators_done or not self.blocks:
+            return
+        order = self._reverse_postorder()
+        rank = dict((block.index, i) for i, block in enumerate(order))
+        idom = {0: 0}
+
+        def intersect(a, b):
+            while a != b:
+                while rank[a] > rank[b]:
+                    a = idom[a]
+                while rank[b] > rank[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for block in order[1:]:
+                new_idom = None
+                for predecessor, _ in block.predecessors:
+                    if predecessor.index in idom:
+                        if new_idom is None:
+                            new_idom = predecessor.index
+                        else:
+                            new_idom = intersect(predecessor.index, new_idom)
+                if idom.get(block.index) != new_idom:
+                    idom[block.index] = new_idom
+                    changed = True
+        for block in order[1:]:
+            block.idom = self.blocks[idom[block.index]]
+        self._dominators_done = True
+
+    def dominators(self, block):
+        """Return the blocks dominating *block*, from itself up to the entry.
+
+        Returns an empty list for a block which cannot be reached.
+        """
+        self._compute_dominators()
+        if block is not self.entry and block.idom is None:
+            return []
+        chain = [block]
+        while chain[-1].idom is not None:
+            chain.append(chain[-1].idom)
+        return chain
+
+    def dominates(self, a, b):
+        """Return True if every path from the entry to block *b* passes
+        through block *a*."""
+        return a in self.dominators(b)
+
+
+# Stack effects as computed by opcode_stack_effect() in CPython 2.7's
+# Python/compile.c, indexed by opcode. Entries are either the effect or a
+# function of the opcode argument. EXTENDED_ARG and NOP, which the compiler
+# never sees, leave the stack unchanged.
+def _nargs(oparg):
+    return (oparg % 256) + 2 * (oparg // 256)
+
+_stack_effects = [None] * 256
+for _name, _effect in [
+        ('POP_TOP', -1), ('ROT_TWO', 0), ('ROT_THREE', 0), ('DUP_TOP', 1),
+        ('ROT_FOUR', 0), ('NOP', 0),
+        ('UNARY_POSITIVE', 0), ('UNARY_NEGATIVE', 0), ('UNARY_NOT', 0),
+        ('UNARY_CONVERT', 0), ('UNARY_INVERT', 0),
+        ('SET_ADD', -1), ('LIST_APPEND', -1), ('MAP_ADD', -2),
+        ('BINARY_POWER', -1), ('BINARY_MULTIPLY', -1), ('BINARY_DIVIDE', -1),
+        ('BINARY_MODULO', -1), ('BINARY_ADD', -1), ('BINARY_SUBTRACT', -1),
+        ('BINARY_SUBSCR', -1), ('BINARY_FLOOR_DIVIDE', -1),
+        ('BINARY_TRUE_DIVIDE', -1), ('BINARY_LSHIFT', -1),
+        ('BINARY_RSHIFT', -1), ('BINARY_AND', -1), ('BINARY_XOR', -1),
+        ('BINARY_OR', -1),
+        ('INPLACE_FLOOR_DIVIDE', -1), ('INPLACE_TRUE_DIVIDE', -1),
+        ('INPLACE_ADD', -1), ('INPLACE_SUBTRACT', -1),
+        ('INPLACE_MULTIPLY', -1), ('INPLACE_DIVIDE', -1),
+        ('INPLACE_MODULO', -1), ('INPLACE_POWER', -1),
+        ('INPLACE_LSHIFT', -1), ('INPLACE_RSHIFT', -1), ('INPLACE_AND', -1),
+        ('INPLACE_XOR', -1), ('INPLACE_OR', -1),
+        ('SLICE+0', 0), ('SLICE+1', -1), ('SLICE+2', -1), ('SLICE+3', -2),
+        ('STORE_SLICE+0', -2), ('STORE_SLICE+1', -3), ('STORE_SLICE+2', -3),
+        ('STORE_SLICE+3', -4),
+        ('DELETE_SLICE+0', -1), ('DELETE_SLICE+1', -2),
+        ('DELETE_SLICE+2', -2), ('DELETE_SLICE+3', -3),
+        ('STORE_SUBSCR', -3), ('STORE_MAP', -2), ('DELETE_SUBSCR', -2),
+        ('GET_ITER', 0),
+        ('PRINT_EXPR', -1), ('PRINT_ITEM', -1), ('PRINT_ITEM_TO', -2),
+        ('PRINT_NEWLINE', 0), ('PRINT_NEWLINE_TO', -1),
+        ('BREAK_LOOP', 0), ('SETUP_WITH', 4), ('WITH_CLEANUP', -1),
+        ('LOAD_LOCALS', 1), ('RETURN_VALUE', -1), ('IMPORT_STAR', -1),
+        ('EXEC_STMT', -3), ('YIELD_VALUE', 0), ('POP_BLOCK', 0),
+        ('END_FINALLY', -3), ('BUILD_CLASS', -2),
+        ('STORE_NAME', -1), ('DELETE_NAME', 0),
+        ('UNPACK_SEQUENCE', lambda oparg: oparg - 1),
+        ('FOR_ITER', 1),
+        ('STORE_ATTR', -2), ('DELETE_ATTR', -1),
+        ('STORE_GLOBAL', -1), ('DELETE_GLOBAL', 0),
+        ('DUP_TOPX', lambda oparg: oparg),
+        ('LOAD_CONST', 1), ('LOAD_NAME', 1),
+        ('BUILD_TUPLE', lambda oparg: 1 - oparg),
+        ('BUILD_LIST', lambda oparg: 1 - oparg),
+        ('BUILD_SET', lambda oparg: 1 - oparg),
+        ('BUILD_MAP', 1), ('LOAD_ATTR', 0), ('COMPARE_OP', -1),
+        ('IMPORT_NAME', -1), ('IMPORT_FROM', 1),
+        ('JUMP_FORWARD', 0), ('JUMP_IF_TRUE_OR_POP', 0),
+        ('JUMP_IF_FALSE_OR_POP', 0), ('JUMP_ABSOLUTE', 0),
+        ('POP_JUMP_IF_FALSE', -1), ('POP_JUMP_IF_TRUE', -1),
+        ('LOAD_GLOBAL', 1), ('CONTINUE_LOOP', 0),
+        ('SETUP_LOOP', 0), ('SETUP_EXCEPT', 0), ('SETUP_FINALLY', 0),
+        ('LOAD_FAST', 1), ('STORE_FAST', -1), ('DELETE_FAST', 0),
+        ('RAISE_VARARGS', lambda oparg: -oparg),
+        ('CALL_FUNCTION', lambda oparg: -_nargs(oparg)),
+        ('CALL_FUNCTION_VAR', lambda oparg: -_nargs(oparg) - 1),
+        ('CALL_FUNCTION_KW', lambda oparg: -_nargs(oparg) - 1),
+        ('CALL_FUNCTION_VAR_KW', lambda oparg: -_nargs(oparg) - 2),
+        ('MAKE_FUNCTION', lambda oparg: -oparg),
+        ('BUILD_SLICE', lambda oparg: -2 if oparg == 3 else -1),
+        ('MAKE_CLOSURE', lambda oparg: -oparg - 1),
+        ('LOAD_CLOSURE', 1), ('LOAD_DEREF', 1), ('STORE_DEREF', -1),
+        ('EXTENDED_ARG', 0)]:
+    _stack_effects[opmap[_name]] = _effect
+del _name, _effect
+
+
+def stack_effect(opcode, oparg=None):
+    """Compute the stack effect of *opcode* with argument *oparg*.
+
+    As in the Python 3 dis module, *oparg* must be given exactly when
+    *opcode* takes an argument. The effect is the one the Python 2.7
+    compiler uses to size co_stacksize, which for jumps is the effect when
+    the jump is not taken.
+    """
+    effect = _stack_effects[opcode] if 0 <= opcode < 256 else None
+    if effect is None:
+        raise ValueError("invalid opcode or oparg")
+    if opcode >= HAVE_ARGUMENT:
+        if oparg is None:
+            raise ValueError("stack_effect: opcode requires oparg but "
+                             "oparg was not specified")
+    elif oparg is not None:
+        raise ValueError("stack_effect: opcode does not permit oparg but "
+                         "oparg was specified")
+    if callable(effect):
+        return effect(oparg)
+    return effect
+
+
+_FOR_ITER = opmap['FOR_ITER']
+_SETUP_HANDLERS = frozenset([opmap['SETUP_EXCEPT'], opmap['SETUP_FINALLY']])
+_JUMP_OR_POP = frozenset([opmap['JUMP_IF_TRUE_OR_POP'],
+                          opmap['JUMP_IF_FALSE_OR_POP']])
+_NO_FALLTHROUGH = frozenset([opmap['JUMP_ABSOLUTE'], opmap['JUMP_FORWARD']])
+
+
+def _stack_walk(code):
+    """Compute stack depths for the bytecode *code*.
+
+    Returns a dict mapping the offset of each reachable instruction to the
+    largest stack depth on entry to it, and the peak depth. This follows
+    stackdepth_walk() in CPython 2.7's Python/compile.c block for block,
+    including its treatment of exception handlers and of the
+    JUMP_IF_*_OR_POP fall through. The walk is depth first with an explicit
+    stack, as large functions would otherwise exceed the recursion limit.
+    """
+    ops, labels = _decode_bytes(code)
+    starts = [i for i, (offset, _, _) in enumerate(ops)
+              if i == 0 or offset in labels]
+    block_of = dict((ops[i][0], b) for b, i in enumerate(starts))
+    starts.append(len(ops))
+    seen = [False] * len(starts)
+    start_depths = [None] * len(starts)
+    depths = {}
+    peak = 0
+    # Frames are [block, instruction index, depth, done]; a frame whose
+    # block has been walked and whose successor call has returned is done.
+    stack = []
+
+    def enter(block, depth):
+        if block < len(starts) - 1 and not seen[block] and (
+                start_depths[block] is None or start_depths[block] < depth):
+            seen[block] = True
+            start_depths[block] = depth
+            stack.append([block, starts[block], depth, False])
+
+    enter(0, 0)
+    while stack:
+        frame = stack[-1]
+        block, i, depth, done = frame
+        if done:
+            seen[block] = False
+            stack.pop()
+            continue
+        if i == starts[block + 1]:
+            frame[3] = True
+            enter(block + 1, depth)
+            continue
+        offset, op, arg = ops[i]
+        if depths.get(offset, depth - 1) < depth:
+            depths[offset] = depth
+        effect = _stack_effects[op]
+        if effect is None:
+            raise ValueError("invalid opcode %d at offset %d" % (op, offset))
+        if callable(effect):
+            effect = effect(arg)
+        depth += effect
+        peak = max(peak, depth)
+        frame[1] = i + 1
+        frame[2] = depth
+        if op in _hasjrel or op in _hasjabs:
+            target = offset + 3 + arg if op in _hasjrel else arg
+            target_depth = depth
+            if op == _FOR_ITER:
+                target_depth = depth - 2
+            elif op in _SETUP_HANDLERS:
+                target_depth = depth + 3
+                peak = max(peak, target_depth)
+            elif op in _JUMP_OR_POP:
+                frame[2] = depth - 1
+            if op in _NO_FALLTHROUGH:
+                frame[3] = True
+            if target in block_of:
+                enter(block_of[target], target_depth)
+    return depths, peak
+
+
+def stack_depths(x):
+    """Return a list of (Instruction, depth) pairs for the code in *x*.
+
+    *depth* is the stack depth on entry to the instruction, or None if it
+    cannot be reached. *x* may be anything accepted by Bytecode.
+    """
+    if not isinstance(x, Bytecode):
+        x = Bytecode(x)
+    depths = _stack_walk(x._decoded.code)[0]
+    return [(instr, depths.get(instr.offset)) for instr in x]
+
+
+def max_stack_depth(x):
+    """Return the peak stack depth the code in *x* needs.
+
+    For code produced by the compiler this is normally co_stacksize. The
+    compiler sizes the stack before the peephole optimizer folds constants,
+    so co_stacksize may be larger; it should never be smaller.
+    """
+    if not isinstance(x, Bytecode):
+        x = Bytecode(x)
+    return _stack_walk(x._decoded.code)[1]
+
+
+InstructionChange = collections.namedtuple("InstructionChange",
+                                           "tag old new")
+CodeDiff = collections.namedtuple("CodeDiff", "path old new changes")
+
+
+def _diff_keys(co, keys):
+    """Return a list of integer comparison keys for the instructions of *co*.
+
+    Instructions get the same key when they have the same opcode and the
+    same argument value, interning through the shared dict *keys*. Jumps
+    are keyed by the distance to their target counted in instructions, so
+    that code moving does not make every jump over it differ while a jump
+    to somewhere else does, and EXTENDED_ARG by opcode alone, as its
+    argument is part of the next instruction's. Nested code objects are
+    keyed by name, as they are compared separately.
+    """
+    arg_kinds = _arg_kinds
+    consts = co.co_consts
+    names = co.co_names
+    varnames = co.co_varnames
+    cells = co.co_cellvars + co.co_freevars
+    ops = _decode_bytes(co.co_code)[0]
+    index = dict((offset, i) for i, (offset, _, _) in enumerate(ops))
+    result = []
+    append = result.append
+    for i, (offset, op, arg) in enumerate(ops):
+        kind = arg_kinds[op]
+        if arg is None or op == EXTENDED_ARG:
+            key = op
+        elif op in _hasjrel or op in _hasjabs:
+            target = index.get(offset + 3 + arg if op in _hasjrel else arg)
+            key = (op, None if target is None else target - i)
+        elif kind == _ARG_CONST:
+            const = consts[arg]
+            if isinstance(const, types.CodeType):
+                key = (op, types.CodeType, const.co_name)
+            else:
+                # Keep 1, 1.0 and True, which compare equal, apart.
+                key = (op, type(const), const)
+        elif kind == _ARG_NAME:
+            key = (op, names[arg])
+        elif kind == _ARG_LOCAL:
+            key = (op, varnames[arg])
+        elif kind == _ARG_FREE:
+            key = (op, cells[arg])
+        else:
+            key = (op, arg)
+        append(keys.setdefault(key, len(keys)))
+    return result
+
+
+def _midpoint(a, b, left, top, right, bottom):
+    """Find the middle snake of the shortest edit between two ranges.
+
+    This is the linear space refinement of Myers' O(ND) difference
+    algorithm, running the forward and backward searches until they
+    overlap. Returns the start and end points of the snake, or None if
+    both ranges are empty.
+    """
+    width = right - left
+    height = bottom - top
+    size = width + height
+    if size == 0:
+        return None
+    delta = width - height
+    odd = delta & 1
+    limit = (size + 1) // 2
+    forward = [0] * (2 * limit + 1)
+    forward[1] = left
+    backward = [0] * (2 * limit + 1)
+    backward[1] = bottom
+    for d in xrange(limit + 1):
+        for k in xrange(d, -d - 1, -2):
+            if k == -d or (k != d and forward[k - 1] < forward[k + 1]):
+                px = x = forward[k + 1]
+            else:
+                px = forward[k - 1]
+                x = px + 1
+            y = top + (x - left) - k
+            py = y if d == 0 or x != px else y - 1
+            while x < right and y < bottom and a[x] == b[y]:
+                x += 1
+                y += 1
+            forward[k] = x
+            c = k - delta
+            if odd and -d < c < d and y >= backward[c]:
+                return (px, py), (x, y)
+        for c in xrange(d, -d - 1, -2):
+            if c == -d or (c != d and backward[c - 1] > backward[c + 1]):
+                py = y = backward[c + 1]
+            else:
+                py = backward[c - 1]
+                y = py - 1
+            k = c + delta
+            x = left + (y - top) + k
+            px = x if d == 0 or y != py else x + 1
+            while x > left and y > top and a[x - 1] == b[y - 1]:
+                x -= 1
+                y -= 1
+            backward[c] = y
+            if not odd and -d <= k <= d and x <= forward[k]:
+                return (x, y), (px, py)
+
+
+def _diff_opcodes(a, b):
+    """Return the edits turning sequence *a* into sequence *b*.
+
+    The result is a list of (tag, i1, i2, j1, j2) tuples as from
+    difflib.SequenceMatcher.get_opcodes(), leaving out 'equal' runs, for a
+    shortest edit script. Common leading and trailing items are trimmed
+    first, so near identical sequences cost little more than a scan.
+    """
+    lo = 0
+    n = min(len(a), len(b))
+    while lo < n and a[lo] == b[lo]:
+        lo += 1
+    a_hi = len(a)
+    b_hi = len(b)
+    while a_hi > lo and b_hi > lo and a[a_hi - 1] == b[b_hi - 1]:
+        a_hi -= 1
+        b_hi -= 1
+    # Collect the path through the edit graph, splitting boxes at their
+    # middle snakes with an explicit stack rather than by recursion.
+    path = []
+    pending = [((lo, lo), (a_hi, b_hi))]
+    while pending:
+        (left, top), (right, bottom) = pending.pop()
+        snake = _midpoint(a, b, left, top, right, bottom)
+        if snake is None:
+            path.append((left, top))
+            continue
+        start, finish = snake
+        pending.append((finish, (right, bottom)))
+        pending.append(((left, top), start))
+    edits = []
+    for (x1, y1), (x2, y2) in itertools.izip(path, path[1:]):
+        while x1 < x2 and y1 < y2 and a[x1] == b[y1]:
+            x1 += 1
+            y1 += 1
+        if x2 - x1 < y2 - y1:
+            edits.append(('insert', x1, x1, y1, y1 + 1))
+        elif x2 - x1 > y2 - y1:
+            edits.append(('delete', x1, x1 + 1, y1, y1))
+    # Merge adjacent single steps into runs, turning runs which both delete
+    # and insert at the same place into replacements.
+    opcodes = []
+    for tag, i1, i2, j1, j2 in edits:
+        if opcodes and opcodes[-1][2] == i1 and opcodes[-1][4] == j1:
+            _, i1, _, j1, _ = opcodes.pop()
+        opcodes.append((tag, i1, i2, j1, j2))
+    return [('replace' if i1 != i2 and j1 != j2 else tag, i1, i2, j1, j2)
+            for tag, i1, i2, j1, j2 in opcodes]
+
+
+def _nested_code(co):
+    """Return the code objects in co_consts, keyed by (name, occurrence)."""
+    nested = collections.OrderedDict()
+    for const in co.co_consts:
+        if isinstance(const, types.CodeType):
+            i = 0
+            while (const.co_name, i) in nested:
+                i += 1
+            nested[const.co_name, i] = const
+    return nested
+
+
+def _instruction_changes(old, new, opcodes):
+    old = list(get_instructions(old)) if old is not None else []
+    new = list(get_instructions(new)) if new is not None else []
+    changes = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        removed = old[i1:i2]
+        added = new[j1:j2]
+        common = min(len(removed), len(added))
+        for before, after in itertools.izip(removed, added):
+            changes.append(InstructionChange('replace', before, after))
+        for before in removed[common:]:
+            changes.append(InstructionChange('delete', before, None))
+        for after in added[common:]:
+            changes.append(InstructionChange('insert', None, after))
+    return changes
+
+
+def diff(a, b):
+    """Compare the bytecode of *a* and *b*.
+
+    Accepts code objects, Bytecode instances, or anything else Bytecode
+    accepts. Returns a list of CodeDiff, one for each code object which
+    differs, starting with *a* and *b* themselves and continuing depth
+    first into the code objects nested in their co_consts, paired by name
+    and order. An empty list means the bytecode is the same.
+
+    Each CodeDiff has the path of co_name values leading to the code object,
+    the old and new code objects (one of them None if the code object only
+    exists on one side) and a list of InstructionChange. Those have a tag of
+    'insert', 'delete' or 'replace' and the old and new Instructions, None
+    standing for the missing side of an insert or delete.
+
+    Instruction streams are aligned with Myers' difference algorithm in
+    linear space, comparing opcodes and argument values but not offsets,
+    so code which merely moves is not reported. Jumps compare by how many
+    instructions they skip, so one whose target changes is reported.
+    """
+    if isinstance(a, Bytecode):
+        a = a.codeobj
+    if isinstance(b, Bytecode):
+        b = b.codeobj
+    a = _get_code_object(a)
+    b = _get_code_object(b)
+    keys = {}
+    result = []
+    pending = [((a.co_name,), a, b)]
+    while pending:
+        path, old, new = pending.pop()
+        old_keys = _diff_keys(old, keys) if old is not None else []
+        new_keys = _diff_keys(new, keys) if new is not None else []
+        opcodes = _diff_opcodes(old_keys, new_keys)
+        if opcodes or old is None or new is None:
+            result.append(CodeDiff(path, old, new, _instruction_changes(
+                old, new, opcodes)))
+        old_nested = _nested_code(old) if old is not None else {}
+        new_nested = _nested_code(new) if new is not None else {}
+        children = [(name, old_nested.get(name), new_nested.get(name))
+                    for name in old_nested]
+        children += [(name, None, new_nested[name])
+                     for name in new_nested if name not in old_nested]
+        for (name, _), old_child, new_child in reversed(children):
+            pending.append((path + (name,), old_child, new_child))
+    return result
+
+
+class _Table(object):
+    """An ordered table of code object names or constants, as built up by
+    the assembler, seeded from the matching tuple of a template."""
+
+    def __init__(self, items=()):
+        self.items = list(items)
+        self._index = {}
+        for index, item in enumerate(self.items):
+            try:
+                self._index.setdefault(self._key(item), index)
+            except TypeError:
+                pass
+
+    @staticmethod
+    def _key(item):
+        # Keep values which compare equal but mean something different
+        # apart, such as 1, 1.0 and True, or 0.0 and -0.0.
+        if isinstance(item, (float, complex)):
+            return type(item), repr(item)
+        return type(item), item
+
+    def add(self, item, index=None):
+        """Return the index of *item*, appending it if it is new.
+
+        *index* is where the item was found before, which is kept if it
+        still holds the same object, even when the table holds duplicates.
+        """
+        if index is not None and 0 <= index < len(self.items) and \
+                self.items[index] is item:
+            return index
+        try:
+            key = self._key(item)
+            index = self._index.get(key)
+        except TypeError:  # Unhashable, so compare by identity
+            key = index = None
+            for i, existing in enumerate(self.items):
+                if existing is item:
+                    index = i
+        if index is None:
+            index = len(self.items)
+            self.items.append(item)
+            if key is not None:
+                self._index[key] = index
+        return index
+
+
+def _encode_lnotab(line_starts, first_line):
+    """Encode (offset, line) pairs, in offset order, as a co_lnotab."""
+    lnotab = bytearray()
+    last_offset = 0
+    last_line = first_line
+    for offset, line in line_starts:
+        byte_incr = offset - last_offset
+        line_incr = line - last_line
+        if line_incr == 0:
+            continue
+        if line_incr < 0:
+            raise ValueError("line %d at offset %d follows line %d; "
+                             "co_lnotab cannot go back" %
+                             (line, offset, last_line))
+        while byte_incr > 255:
+            lnotab += b'\xff\x00'
+            byte_incr -= 255
+        while line_incr > 255:
+            lnotab += bytearray((byte_incr, 255))
+            byte_incr = 0
+            line_incr -= 255
+        lnotab += bytearray((byte_incr, line_incr))
+        last_offset = offset
+        last_line = line
+    return bytes(lnotab)
+
+
+def assemble(instructions, code=None, first_line=None):
+    """Build a code object from a sequence of Instructions.
+
+    *instructions* is usually a Bytecode or the output of get_instructions()
+    after editing. The opcode and argval of each instruction are used;
+    offsets only identify jump targets, and a jump to offset n goes to the
+    first instruction with that offset. EXTENDED_ARG instructions are
+    dropped and added again wherever an argument needs them. starts_line
+    gives the line table.
+
+    Names, variable names and constants keep their positions in *code*
+    (by default, the code object of a Bytecode passed as *instructions*),
+    which also supplies the remaining attributes, and new ones are added
+    after them. Cell and free variables must exist in *code* already.
+    *first_line* defaults to the first line of the Bytecode or *code*.
+    """
+    if isinstance(instructions, Bytecode):
+        if code is None:
+            code = instructions.codeobj
+        if first_line is None:
+            first_line = instructions.first_line
+    instructions = list(instructions)
+    if code is not None:
+        consts = _Table(code.co_consts)
+        names = _Table(code.co_names)
+        varnames = _Table(code.co_varnames)
+        cells = code.co_cellvars + code.co_freevars
+        if first_line is None:
+            first_line = code.co_firstlineno
+    else:
+        consts = _Table()
+        names = _Table()
+        varnames = _Table()
+        cells = ()
+        if first_line is None:
+            first_line = next((instr.starts_line for instr in instructions
+                               if instr.starts_line is not None), 1)
+
+    # Resolve arguments, leaving jump targets as offsets into the input.
+    ops = []
+    targets = {}
+    for instr in instructions:
+        op = instr.opcode
+        if instr.offset is not None:
+            # A jump to an EXTENDED_ARG lands on the instruction it prefixes
+            targets.setdefault(instr.offset, len(ops))
+        if op == EXTENDED_ARG:
+            continue
+        arg = instr.argval if instr.argval is not None else instr.arg
+        if op < HAVE_ARGUMENT:
+            arg = None
+        elif op in _hasjrel or op in _hasjabs:
+            pass
+        else:
+            kind = _arg_kinds[op]
+            if kind == _ARG_CONST:
+                arg = consts.add(instr.argval, instr.arg)
+            elif kind == _ARG_NAME:
+                arg = names.add(arg, instr.arg)
+            elif kind == _ARG_LOCAL:
+                arg = varnames.add(arg, instr.arg)
+            elif kind == _ARG_COMPARE:
+                arg = cmp_op.index(arg)
+            elif kind == _ARG_FREE:
+                if arg not in cells:
+                    raise ValueError("%r is not a cell or free variable"
+                                     % (arg,))
+                arg = cells.index(arg)
+            elif arg is None:
+                raise ValueError("%s needs an argument" % instr.opname)
+        ops.append((op, arg, instr.starts_line))
+    for op, arg, _ in ops:
+        if (op in _hasjrel or op in _hasjabs) and arg not in targets:
+            raise ValueError("jump to offset %r, which is not the offset of "
+                             "an instruction" % (arg,))
+
+    # Lay out the code, widening instructions whose argument needs an
+    # EXTENDED_ARG prefix until the jump offsets no longer change. Jumps
+    # start narrow, since their input offsets say nothing about the new
+    # layout, and only ever grow.
+    sizes = [1 if arg is None else
+             3 if op in _hasjrel or op in _hasjabs or arg <= 0xffff else 6
+             for op, arg, _ in ops]
+    while True:
+        offsets = [0] * (len(ops) + 1)
+        for i, size in enumerate(sizes):
+            offsets[i + 1] = offsets[i] + size
+        args = []
+        changed = False
+        for i, (op, arg, _) in enumerate(ops):
+            if op in _hasjabs:
+                arg = offsets[targets[arg]]
+            elif op in _hasjrel:
+                arg = offsets[targets[arg]] - offsets[i + 1]
+                if arg < 0:
+                    raise ValueError("relative jump at offset %d goes "
+                                     "backwards" % offsets[i])
+            if arg is not None and arg > 0xffff and sizes[i] == 3:
+                sizes[i] = 6
+                changed = True
+            args.append(arg)
+        if not changed:
+            break
+
+    co_code = bytearray()
+    line_starts = []
+    for i, (op, _, starts_line) in enumerate(ops):
+        arg = args[i]
+        if starts_line is not None:
+            line_starts.append((offsets[i], starts_line))
+        if arg is None:
+            co_code.append(op)
+            continue
+        if sizes[i] == 6:
+            if arg > 0xffffffff:
+                raise ValueError("argument %d of %s does not fit in 32 bits"
+                                 % (arg, opname[op]))
+            co_code += bytearray((EXTENDED_ARG, (arg >> 16) & 0xff,
+                                  arg >> 24))
+        co_code += bytearray((op, arg & 0xff, (arg >> 8) & 0xff))
+    co_code = bytes(co_code)
+    lnotab = _encode_lnotab(line_starts, first_line)
+
+    if code is not None:
+        argcount = code.co_argcount
+        flags = code.co_flags
+        filename = code.co_filename
+        name = code.co_name
+        freevars = code.co_freevars
+        cellvars = code.co_cellvars
+    else:
+        argcount = 0
+        flags = 0
+        filename = name = '<assembly>'
+        freevars = cellvars = ()
+    return types.CodeType(argcount, len(varnames.items),
+                          _stack_walk(co_code)[1], flags, co_code,
+                          tuple(consts.items), tuple(names.items),
+                          tuple(varnames.items), filename, name, first_line,
+                          lnotab, freevars, cellvars)
+
+
+_PYC_SUFFIXES = ('.pyc', '.pyo')
+
+
+def _load_pyc(file):
+    """Return the code object marshalled in an open .pyc or .pyo *file*.
+
+    The 8 byte header (magic number and source modification time) is
+    checked against the running interpreter and skipped.
+    """
+    _check_pyc_header(file.read(8), getattr(file, 'name', '<pyc>'))
+    return marshal.load(file)
+
+
+def _check_pyc_header(header, name):
+    if header[:4] != imp.get_magic():
+        raise ValueError("%s is not a compiled file for this Python version"
+                         % name)
+
+
+def _load_code(path):
+    """Return the code object of a .pyc file, or of a source file compiled
+    without writing bytecode. A *path* of '-' reads source from stdin.
+    """
+    if path == '-':
+        return compile(sys.stdin.read(), '<stdin>', 'exec')
+    with open(path, 'rb') as infile:
+        if path.endswith(_PYC_SUFFIXES):
+            return _load_pyc(infile)
+        source = infile.read()
+    return compile(source, path, 'exec')
+
+
+def _find_code_files(paths):
+    """Generate file paths from *paths*, expanding each directory into the
+    .pyc and .pyo files in the tree beneath it, in sorted order.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(_PYC_SUFFIXES):
+                    yield os.path.join(dirpath, filename)
+
+
+class _MappedFile(object):
+    """The file methods zipfile needs, over an mmap whose read() requires
+    a size in Python 2."""
+
+    def __init__(self, map):
+        self._map = map
+        self.seek = map.seek
+        self.tell = map.tell
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self._map) - self._map.tell()
+        return self._map.read(size)
+
+
+class PycArchive(object):
+    """Lazy reader of code objects from a .pyc file or a zip archive of them.
+
+    The file is memory mapped rather than read. For zip archives (eggs,
+    wheels) members are located through the central directory and only
+    the members asked for are read and unmarshalled. The code objects
+    returned can be passed straight to Bytecode, get_instructions or dis.
+
+        with PycArchive('dist/package.egg') as archive:
+            for name in archive.names():
+                ...
+            code = archive.get_code('package/module.pyc', 'Class.method')
+    """
+
+    def __init__(self, path):
+        import mmap
+        import zipfile
+        self.path = path
+        self._codes = {}
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mapped = _MappedFile(self._map)
+        if zipfile.is_zipfile(mapped):
+            self._zip = zipfile.ZipFile(mapped)
+            self._names = [name for name in self._zip.namelist()
+                           if name.endswith(_PYC_SUFFIXES)]
+        else:
+            self._zip = None
+            self._names = [os.path.basename(path)]
+
+    def names(self):
+        """Return the names of the compiled modules in the archive."""
+        return list(self._names)
+
+    def get_code(self, name, qualname=None):
+        """Return the code object of the compiled module *name*.
+
+        If *qualname* is given, return instead the code object nested
+        within the module whose co_name path matches it, for example
+        'Class.method' or 'function.<lambda>'.
+        """
+        try:
+            code = self._codes[name]
+        except KeyError:
+            if name not in self._names:
+                raise KeyError("%s has no compiled module %r"
+                               % (self.path, name))
+            if self._zip is None:
+                data = self._map
+            else:
+                data = self._zip.read(name)
+            _check_pyc_header(data[:8], name)
+            code = self._codes[name] = marshal.loads(data[8:])
+        if qualname is not None:
+            for part in qualname.split('.'):
+                for const in code.co_consts:
+                    if getattr(const, 'co_name', None) == part:
+                        code = const
+                        break
+                else:
+                    raise KeyError("%s has no code object %r"
+                                   % (name, qualname))
+        return code
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _decode_file(job):
+    """Load and decode one file for dis_files(), typically in a worker.
+
+    *job* is a (path, depth) pair. Returns a list of (title, rows) pairs,
+    one for the module code object (with a title of None) and one for each
+    nested code object within *depth* levels, in the order dis() would
+    print them. Each row is a compact (opcode, arg, argrepr, offset,
+    starts_line, is_jump_target) tuple, which is cheaper to send between
+    processes than rendered text and does not need argval to be picklable.
+    """
+    path, depth = job
+    sections = []
+    pending = [(None, _load_code(path), depth)]
+    seen = set()
+    while pending:
+        title, co, depth = pending.pop()
+        rows = [(instr.opcode, instr.arg, instr.argrepr, instr.offset,
+                 instr.starts_line, instr.is_jump_target)
+                for instr in _get_decoded(co).get_instructions()]
+        sections.append((title, rows))
+        if depth is None or depth > 0:
+            if depth is not None:
+                depth = depth - 1
+            nested = [x for x in co.co_consts
+                      if hasattr(x, 'co_code') and id(x) not in seen]
+            seen.update(map(id, nested))
+            pending.extend(("%r" % (x,), x, depth) for x in reversed(nested))
+    return sections
+
+
+def _format_decoded_file(path, sections):
+    """Generate the disassembly lines of a file decoded by _decode_file."""
+    yield "Disassembly of %s:" % path
+    for title, rows in sections:
+        if title is not None:
+            yield ''
+            yield "Disassembly of %s:" % title
+        instructions = (Instruction(opname[op], op, arg, None, argrepr,
+                                    offset, starts_line, is_jump_target)
+                        for op, arg, argrepr, offset, starts_line,
+                        is_jump_target in rows)
+        for line in _format_instructions(instructions):
+            yield line
+    yield ''
+
+
+def dis_files(paths, file=None, depth=0, processes=None, chunksize=8):
+    """Disassemble source files, .pyc files and directories of .pyc files.
+
+    Files are loaded and decoded by a pool of *processes* worker processes
+    (default: one per CPU), handed out *chunksize* files at a time. The
+    output is written to *file* in the order of *paths*, regardless of
+    which worker finishes first. With *processes* set to 1 everything runs
+    in the calling process. *depth* is passed on as for dis().
+    """
+    jobs = [(path, depth) for path in _find_code_files(paths)]
+    if processes == 1:
+        results = itertools.imap(_decode_file, jobs)
+        pool = None
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(_decode_file, jobs, chunksize)
+    try:
+        for (path, _), sections in itertools.izip(jobs, results):
+            _write_lines(_format_decoded_file(path, sections), file=file)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+class OpcodeStats(object):
+    """Opcode usage counts accumulated over many code objects.
+
+    opcodes is an array of 256 counts indexed by opcode, pairs a Counter of
+    consecutive opcode pairs keyed by (first << 8 | second), and functions
+    a list of (filename, firstlineno, name, instruction count) tuples, one
+    per code object counted. Code is decoded straight from co_code without
+    creating Instructions. Instances merge with update(), pickle for
+    sending between processes, and save with dump() and load() for
+    combining the results of separate runs.
+    """
+
+    def __init__(self):
+        self.opcodes = array.array('L', [0] * 256)
+        self.pairs = collections.Counter()
+        self.functions = []
+
+    def add_code(self, co):
+        """Count the instructions of *co* and the code objects nested in it."""
+        opcodes = self.opcodes
+        pairs = self.pairs
+        pending = [co]
+        while pending:
+            co = pending.pop()
+            ops = [op for _, op, _ in _decode_bytes(co.co_code)[0]]
+            for op in ops:
+                opcodes[op] += 1
+            pairs.update(itertools.imap(lambda a, b: a << 8 | b,
+                                        ops, itertools.islice(ops, 1, None)))
+            self.functions.append((co.co_filename, co.co_firstlineno,
+                                   co.co_name, len(ops)))
+            pending.extend(x for x in reversed(co.co_consts)
+                           if hasattr(x, 'co_code'))
+
+    def add(self, x):
+        """Count the code in *x*.
+
+        *x* may be a module, a path to a source file, .pyc file or
+        directory of .pyc files, or anything dis() accepts.
+        """
+        if isinstance(x, types.ModuleType):
+            x = _module_file(x)
+        if isinstance(x, str) and os.path.exists(x):
+            for path in _find_code_files([x]):
+                self.add_code(_load_code(path))
+        else:
+            self.add_code(_get_code_object(x))
+
+    def update(self, other):
+        """Add the counts of the OpcodeStats *other* to this one."""
+        opcodes = self.opcodes
+        for op, count in enumerate(other.opcodes):
+            opcodes[op] += count
+        self.pairs.update(other.pairs)
+        self.functions.extend(other.functions)
+
+    @property
+    def total(self):
+        """The number of instructions counted."""
+        return int(sum(self.opcodes))
+
+    def most_common(self, n=None):
+        """Return a list of the *n* most used (opname, count) pairs."""
+        counts = sorted(((int(count), opname[op])
+                         for op, count in enumerate(self.opcodes) if count),
+                        key=lambda item: -item[0])
+        return [(name, count) for count, name in counts[:n]]
+
+    def most_common_pairs(self, n=None):
+        """Return a list of the *n* most used ((opname, opname), count)."""
+        return [((opname[key >> 8], opname[key & 0xff]), count)
+                for key, count in self.pairs.most_common(n)]
+
+    def dump(self, file):
+        """Write the counts to the open binary *file* with marshal."""
+        file.write(marshal.dumps((self.opcodes.tolist(), dict(self.pairs),
+                                  self.functions)))
+
+    @classmethod
+    def load(cls, file):
+        """Read counts written by dump() from the open binary *file*."""
+        opcodes, pairs, functions = marshal.loads(file.read())
+        stats = cls()
+        stats.opcodes = array.array('L', opcodes)
+        stats.pairs.update(pairs)
+        stats.functions = functions
+        return stats
+
+    def __repr__(self):
+        return "<%s: %d instructions in %d code objects>" % (
+            self.__class__.__name__, self.total, len(self.functions))
+
+
+def _module_file(module):
+    """Return the path of the compiled or source file of *module*."""
+    path = getattr(module, '__file__', None)
+    if path is None:
+        raise TypeError("module %s has no file" % module.__name__)
+    if not path.endswith(_PYC_SUFFIXES) and not path.endswith('.py'):
+        raise TypeError("module %s is not Python code" % module.__name__)
+    if path.endswith(_PYC_SUFFIXES) and not os.path.exists(path):
+        path = path[:-1]
+    return path
+
+
+def _file_stats(path):
+    """Count the opcodes of one file for opcode_stats(), in a worker."""
+    stats = OpcodeStats()
+    stats.add_code(_load_code(path))
+    return stats
+
+
+def opcode_stats(paths, processes=None, chunksize=8):
+    """Return the OpcodeStats of source files, .pyc files and directories.
+
+    Files are counted by a pool of *processes* worker processes, as for
+    dis_files(), and the results merged. With *processes* set to 1
+    everything runs in the calling process.
+    """
+    paths = list(_find_code_files(paths))
+    if processes == 1:
+        results = itertools.imap(_file_stats, paths)
+        pool = None
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(_file_stats, paths, chunksize)
+    stats = OpcodeStats()
+    try:
+        for file_stats in results:
+            stats.update(file_stats)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return stats
 
 
 def _test():
-    """Simple test program to disassemble a file."""
+    """Simple test program to disassemble source, .pyc files or directories
+    of .pyc files."""
     import argparse
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('infile', type=argparse.FileType(), nargs='?',
-                        default='-')
+    parser.add_argument('infile', nargs='*', default=['-'],
+                        help='source file, .pyc file or directory of .pyc '
+                             'files (default: source from stdin)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes, 0 for one per CPU '
+                             '(default: 1)')
+    parser.add_argument('--chunksize', type=int, default=8,
+                        help='files handed to a worker at a time '
+                             '(default: 8)')
     args = parser.parse_args()
-    with args.infile as infile:
-        source = infile.read()
-    code = compile(source, args.infile.name, "exec")
-    dis(code)
+    if len(args.infile) > 1 or any(map(os.path.isdir, args.infile)):
+        if args.jobs != 1 and '-' in args.infile:
+            parser.error("source from stdin needs --jobs 1")
+        dis_files(args.infile, processes=args.jobs or None,
+                  chunksize=args.chunksize)
+    else:
+        dis(_load_code(args.infile[0]))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,189 @@
+"""Micro-benchmarks for the backports.dis decoder.
+
+Run from the src directory with::
+
+    python -m backports.tests.bench_dis
+"""
+
+from __future__ import print_function
+# std
+import sys
+import types
+import timeit
+from opcode import hasconst, hasname, hasjrel, haslocal, hascompare, hasfree
+# backports
+from backports import dis as backports_dis
+from backports.tests.test_objects import objects_to_test
+from backports.tests.bench_scaling import peak_memory_kb
+
+
+############################## Utility Functions ###############################
+
+def collect_code_objects(objects):
+    """
+    Gather every code object reachable from the objects under test, including
+    those nested in co_consts and in the namespaces of classes and modules.
+
+    :param objects: Iterable of objects accepted by dis.
+
+    :return: List of code objects.
+    """
+    found = []
+    pending = list(objects)
+    while pending:
+        x = pending.pop()
+        if isinstance(x, types.TracebackType):
+            x = x.tb_frame.f_code
+        if isinstance(x, (type, types.ClassType, types.ModuleType)):
+            pending.extend(v for v in vars(x).values()
+                           if isinstance(v, backports_dis._have_code))
+            continue
+        try:
+            co = backports_dis._get_code_object(x)
+        except (TypeError, SyntaxError):
+            continue
+        if isinstance(co, str):
+            continue
+        found.append(co)
+        pending.extend(c for c in co.co_consts if hasattr(c, 'co_code'))
+    return found
+
+
+def membership_kind(op):
+    """The has* list scan used before the opcode dispatch table existed."""
+    if op in hasconst:
+        return backports_dis._ARG_CONST
+    elif op in hasname:
+        return backports_dis._ARG_NAME
+    elif op in hasjrel:
+        return backports_dis._ARG_JREL
+    elif op in haslocal:
+        return backports_dis._ARG_LOCAL
+    elif op in hascompare:
+        return backports_dis._ARG_COMPARE
+    elif op in hasfree:
+        return backports_dis._ARG_FREE
+    elif op in backports_dis.hasnargs:
+        return backports_dis._ARG_NARGS
+    return backports_dis._ARG_PLAIN
+
+
+def table_kind(op, arg_kinds=backports_dis._arg_kinds):
+    """The single indexed lookup used by the decode loop."""
+    return arg_kinds[op]
+
+
+def best_of(function, repeat=5, number=20):
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number
+
+
+################################## Benchmarks ##################################
+
+def bench_arg_dispatch(codes):
+    """
+    Time argument-kind classification for every instruction in *codes* using
+    the has* membership chain and the precomputed dispatch table.
+
+    :return: Tuple of (instruction count, chain seconds, table seconds).
+    """
+    ops = [op for co in codes
+           for _, op, arg in backports_dis._decode_bytes(co.co_code)[0]
+           if arg is not None]
+    for op in ops:
+        assert membership_kind(op) == table_kind(op)
+
+    def chain():
+        for op in ops:
+            membership_kind(op)
+
+    def table():
+        for op in ops:
+            table_kind(op)
+
+    return len(ops), best_of(chain), best_of(table)
+
+
+def bench_get_instructions(codes):
+    """
+    Time a full get_instructions decode of every code object in *codes*.
+
+    :return: Tuple of (instruction count, seconds).
+    """
+    count = sum(len(list(backports_dis.get_instructions(co))) for co in codes)
+
+    def decode():
+        for co in codes:
+            for _ in backports_dis.get_instructions(co):
+                pass
+
+    return count, best_of(decode)
+
+
+class DictInstruction(backports_dis._Instruction):
+    """The Instruction layout before __slots__, with room for an instance
+    dict, which is only allocated if an attribute is ever assigned."""
+
+
+def hold_instructions(codes, copies, with_dict=False):
+    """Decode *codes* *copies* times, keeping every instruction alive,
+    converted to DictInstruction if *with_dict* is true."""
+    held = []
+    for _ in range(copies):
+        for co in codes:
+            instructions = backports_dis.get_instructions(co)
+            if with_dict:
+                instructions = (DictInstruction._make(instr[:])
+                                for instr in instructions)
+            held.extend(instructions)
+    return held
+
+
+def bench_instruction_memory(codes, records=200000):
+    """
+    Measure the resident memory of about *records* decoded instructions,
+    once as Instruction and once as the DictInstruction layout it replaced.
+    Each layout is built in a fresh child process, so the figures include
+    everything an instruction keeps alive, such as the _LazyRepr of a
+    constant, and not just the record itself.
+
+    :return: Tuple of (instruction count, dict layout KB, slots layout KB,
+             bytes of _LazyRepr per instruction), with None for the KB
+             figures where they cannot be measured.
+    """
+    instructions = [instr for co in codes
+                    for instr in backports_dis.get_instructions(co)]
+    copies = max(1, records // len(instructions))
+    target = 'backports.tests.bench_dis:hold_instructions'
+    with_dict = peak_memory_kb(target, codes, copies, True)
+    slots = peak_memory_kb(target, codes, copies)
+    lazy = sum(sys.getsizeof(instr[4]) for instr in instructions
+               if isinstance(instr[4], backports_dis._LazyRepr))
+    return (len(instructions) * copies, with_dict, slots,
+            lazy / float(len(instructions)))
+
+
+def main():
+    codes = collect_code_objects(objects_to_test.values())
+    n, chain, table = bench_arg_dispatch(codes)
+    print('%d code objects' % len(codes))
+    print('argument dispatch over %d instructions with an argument:' % n)
+    print('  has* chain     %8.1f ns/instruction' % (chain / n * 1e9))
+    print('  opcode table   %8.1f ns/instruction (%.1fx)' %
+          (table / n * 1e9, chain / table))
+    n, decode = bench_get_instructions(codes)
+    print('get_instructions over %d instructions:' % n)
+    print('  decode         %8.1f ns/instruction' % (decode / n * 1e9))
+    n, with_dict, slots, lazy = bench_instruction_memory(codes)
+    print('resident memory of %d instructions:' % n)
+    print('  record sizes   %8d bytes with __dict__, %d with __slots__' % (
+        sys.getsizeof(DictInstruction(*range(8))),
+        sys.getsizeof(backports_dis.Instruction(*range(8)))))
+    print('  _LazyRepr      %8.1f bytes/instruction' % lazy)
+    if with_dict is None or slots is None:
+        print('  (resident sizes need the resource module)')
+        return
+    for name, kb in (('with __dict__', with_dict), ('__slots__', slots)):
+        print('  %-14s %8.1f bytes/instruction' % (name, kb * 1024.0 / n))
+
+if __name__ == '__main__':
+    main()
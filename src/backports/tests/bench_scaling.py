@@ -0,0 +1,292 @@
+"""Scaling benchmarks for backports.dis over synthetic code objects.
+
+Run from the src directory with::
+
+    python -m backports.tests.bench_scaling --save results.json
+    python -m backports.tests.bench_scaling --baseline results.json
+
+The second form compares against a saved run and exits with status 1 if
+any operation got slower by more than the threshold.
+"""
+
+from __future__ import print_function
+# std
+import sys
+import json
+import marshal
+import types
+import timeit
+import argparse
+import platform
+import subprocess
+try:
+    import resource
+except ImportError:  # Not on Windows
+    resource = None
+# backports
+from backports import dis as backports_dis
+
+
+############################ Synthetic Code Objects ############################
+
+def jumps_source(size):
+    """A function of chained comparisons, about 8 instructions and one
+    conditional jump per branch."""
+    lines = ['def f(x):']
+    for i in range(size // 8):
+        lines.append('    if x == %d:' % i)
+        lines.append('        x = x + 1')
+    lines.append('    return x')
+    return '\n'.join(lines) + '\n'
+
+
+def constants_source(size):
+    """A function storing a distinct constant on every line."""
+    lines = ['def f():']
+    for i in range(size // 2):
+        lines.append('    x = %r' % ('c%d' % i))
+    return '\n'.join(lines) + '\n'
+
+
+def nesting_source(size, depth=20):
+    """Chains of *depth* nested functions, repeated to reach *size*."""
+    lines = []
+    for chain in range(max(1, size // (depth * 8))):
+        for level in range(depth):
+            indent = '    ' * level
+            lines.append('%sdef f%d_%d(x):' % (indent, chain, level))
+            lines.append('%s    y = x + %d' % (indent, level))
+        for level in reversed(range(depth)):
+            indent = '    ' * (level + 1)
+            if level + 1 < depth:
+                lines.append('%sreturn f%d_%d(y)' % (indent, chain,
+                                                     level + 1))
+            else:
+                lines.append('%sreturn y' % indent)
+    return '\n'.join(lines) + '\n'
+
+
+def extended_arg_code(size):
+    """The constants function, reassembled behind 65536 padding constants
+    so that every LOAD_CONST needs an EXTENDED_ARG prefix."""
+    module = compile(constants_source(size), '<extended_arg>', 'exec')
+    [co] = [c for c in module.co_consts if hasattr(c, 'co_code')]
+    padding = tuple(range(-65536, 0))
+    template = types.CodeType(
+        co.co_argcount, co.co_nlocals, co.co_stacksize, co.co_flags,
+        co.co_code, padding, co.co_names, co.co_varnames, co.co_filename,
+        co.co_name, co.co_firstlineno, co.co_lnotab, co.co_freevars,
+        co.co_cellvars)
+    return backports_dis.assemble(backports_dis.Bytecode(co), template)
+
+
+def make_case(kind, size):
+    """Return the code objects of the synthetic case *kind* at *size*,
+    including every nested code object."""
+    if kind == 'extended_arg':
+        return [extended_arg_code(size)]
+    source = CASES[kind](size)
+    found = []
+    pending = [compile(source, '<%s>' % kind, 'exec')]
+    while pending:
+        co = pending.pop()
+        found.append(co)
+        pending.extend(c for c in co.co_consts if hasattr(c, 'co_code'))
+    return found
+
+
+CASES = {
+    'jumps': jumps_source,
+    'constants': constants_source,
+    'nesting': nesting_source,
+    'extended_arg': None,
+}
+
+
+################################## Operations ##################################
+
+def op_get_instructions(codes):
+    for co in codes:
+        for _ in backports_dis.get_instructions(co):
+            pass
+
+
+def op_bytecode_dis(codes):
+    for co in codes:
+        backports_dis.Bytecode(co).dis()
+
+
+def op_findlabels(codes):
+    for co in codes:
+        backports_dis.findlabels(co.co_code)
+
+
+def op_findlinestarts(codes):
+    for co in codes:
+        for _ in backports_dis.findlinestarts(co):
+            pass
+
+
+def op_code_info(codes):
+    for co in codes:
+        backports_dis.code_info(co)
+
+
+OPERATIONS = [
+    ('get_instructions', op_get_instructions),
+    ('Bytecode.dis', op_bytecode_dis),
+    ('findlabels', op_findlabels),
+    ('findlinestarts', op_findlinestarts),
+    ('code_info', op_code_info),
+]
+
+
+################################# Measurement ##################################
+
+def peak_memory_kb(target, *args):
+    """
+    Call the function *target*, named as 'module:function', with *args* in
+    a fresh interpreter and return how far its peak resident set size rose
+    above the size once the arguments were loaded, in kilobytes. A new
+    process, rather than a fork of this one, has no memory freed by earlier
+    runs to reuse, so the result does not depend on what ran before.
+
+    :param args: Values marshal can write, such as code objects.
+
+    :return: The increase, or None where resource is unavailable or the
+             child failed.
+    """
+    if resource is None:
+        return None
+    child = subprocess.Popen(
+        [sys.executable, '-c', 'from backports.tests.bench_scaling import '
+         'run_peak_memory; run_peak_memory()'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output, _ = child.communicate(marshal.dumps((target, args)))
+    if child.returncode != 0 or not output.strip():
+        return None
+    return int(output)
+
+
+def peak_rss_kb():
+    """The peak resident set size of this process in kilobytes. Linux
+    carries the RSS of the parent over into ru_maxrss across exec, so the
+    high-water mark of the process's own memory is read from /proc where
+    it exists."""
+    try:
+        with open('/proc/self/status') as infile:
+            for line in infile:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_peak_memory():
+    """The child side of peak_memory_kb(): read the target and arguments
+    from stdin, call it and print the rise in peak RSS."""
+    target, args = marshal.loads(sys.stdin.read())
+    module, name = target.split(':')
+    function = getattr(__import__(module, fromlist=[name]), name)
+    before = peak_rss_kb()
+    function(*args)
+    print(peak_rss_kb() - before)
+
+
+def measure(kind, size, repeat):
+    """
+    Time every operation on the synthetic case *kind* at *size*.
+
+    :return: List of result dicts, one per operation.
+    """
+    codes = make_case(kind, size)
+    count = sum(len(backports_dis._decode_bytes(co.co_code)[0])
+                for co in codes)
+    results = []
+    for name, operation in OPERATIONS:
+        seconds = min(timeit.repeat(lambda: operation(codes),
+                                    repeat=repeat, number=1))
+        peak = peak_memory_kb('backports.tests.bench_scaling:' +
+                              operation.__name__, codes)
+        results.append(dict(case=kind, size=size, operation=name,
+                            instructions=count, seconds=seconds,
+                            instructions_per_second=count / seconds,
+                            peak_kb=peak))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Match *results* with the *baseline* results of the same case, size and
+    operation.
+
+    :return: List of (result, baseline seconds, ratio) for every result
+             more than *threshold* (a fraction) slower than its baseline.
+    """
+    def key(result):
+        return result['case'], result['size'], result['operation']
+    previous = dict((key(result), result) for result in baseline)
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        ratio = result['seconds'] / old['seconds']
+        if ratio > 1 + threshold:
+            regressions.append((result, old['seconds'], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000],
+                        help='approximate instruction counts per case')
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES),
+                        default=sorted(CASES))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timing runs per operation, best is kept')
+    parser.add_argument('--save', metavar='FILE',
+                        help='write the results to FILE as JSON')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='compare against results saved in FILE')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='slowdown flagged as a regression, as a '
+                             'fraction (default: 0.25)')
+    args = parser.parse_args(argv)
+
+    results = []
+    print('%-13s %7s %-17s %9s %12s %10s' % (
+        'case', 'size', 'operation', 'instrs', 'instrs/s', 'peak KB'))
+    for kind in args.cases:
+        for size in args.sizes:
+            for result in measure(kind, size, args.repeat):
+                results.append(result)
+                peak = result['peak_kb']
+                print('%-13s %7d %-17s %9d %12.0f %10s' % (
+                    kind, size, result['operation'], result['instructions'],
+                    result['instructions_per_second'],
+                    '-' if peak is None else peak))
+
+    if args.save:
+        with open(args.save, 'w') as outfile:
+            json.dump(dict(python=platform.python_version(),
+                           results=results), outfile, indent=1,
+                      sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for result, old_seconds, ratio in regressions:
+            print('REGRESSION %s %d %s: %.4fs -> %.4fs (%.2fx)' % (
+                result['case'], result['size'], result['operation'],
+                old_seconds, result['seconds'], ratio))
+        if regressions:
+            return 1
+        print('no regressions against %s' % args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
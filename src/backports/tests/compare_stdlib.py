@@ -0,0 +1,191 @@
+"""Differential check of backports.dis against the standard library dis.
+
+Every code object compiled from the Python files under the given
+directories (default: the standard library and site-packages) is
+disassembled by both modules. The listings are compared after removing
+the differences the backport makes on purpose, and the throughput of the
+two is reported. Run from the src directory with::
+
+    python -m backports.tests.compare_stdlib [--show N] [directory ...]
+
+Exits with status 1 if any listing differs.
+"""
+
+from __future__ import print_function
+# std
+import os
+import re
+import sys
+import timeit
+import difflib
+import argparse
+import StringIO
+import dis as original_dis
+from distutils import sysconfig
+# backports
+from backports import dis as backports_dis
+
+
+############################## Utility Functions ###############################
+
+def default_roots():
+    """The standard library and site-packages directories, without
+    duplicates."""
+    roots = []
+    for root in (sysconfig.get_python_lib(standard_lib=True),
+                 sysconfig.get_python_lib()):
+        if os.path.isdir(root) and root not in roots:
+            roots.append(root)
+    return roots
+
+
+def find_sources(roots):
+    """Generate the .py files beneath *roots*, in sorted order."""
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith('.py'):
+                    yield os.path.join(dirpath, filename)
+
+
+def iter_code_objects(co):
+    """Generate *co* and every code object nested in its constants."""
+    pending = [co]
+    while pending:
+        co = pending.pop()
+        yield co
+        pending.extend(c for c in reversed(co.co_consts)
+                       if hasattr(c, 'co_code'))
+
+
+_nargs = re.compile(r' ?\([0-9]+ positional, [0-9]+ keyword pair\)')
+_empty_argrepr = re.compile(r' \(\)$')
+_spaces = re.compile(r'\s+')
+
+
+def normalize(listing):
+    """
+    Remove the intended differences between the two listings: the argument
+    counts the backport shows for calls, the empty parentheses Python 2
+    shows for an empty name (as in relative imports), where Python 3
+    shows nothing, and the column padding, which differs between the
+    Python 2 and 3 layouts.
+
+    :param listing: Output of either disassembler.
+
+    :return: List of normalized lines.
+    """
+    lines = []
+    for line in listing.splitlines():
+        line = _spaces.sub(' ', _nargs.sub('', line)).strip()
+        lines.append(_empty_argrepr.sub('', line))
+    return lines
+
+
+def original_listing(co):
+    """Disassemble *co* with the standard library, which prints."""
+    stream = StringIO.StringIO()
+    stdout = sys.stdout
+    sys.stdout = stream
+    try:
+        original_dis.disassemble(co)
+    finally:
+        sys.stdout = stdout
+    return stream.getvalue()
+
+
+def backport_listing(co):
+    """Disassemble *co* with backports.dis."""
+    stream = StringIO.StringIO()
+    backports_dis.disassemble(co, file=stream)
+    return stream.getvalue()
+
+
+################################## Comparison ##################################
+
+class Report(object):
+    """Totals of a comparison run."""
+
+    def __init__(self):
+        self.files = 0
+        self.skipped = 0
+        self.code_objects = 0
+        self.instructions = 0
+        self.original_seconds = 0.0
+        self.backport_seconds = 0.0
+        self.mismatches = []
+
+    def check(self, co, path):
+        """Disassemble *co* with both modules, timing each, and record a
+        mismatch if the normalized listings differ."""
+        timer = timeit.default_timer
+        start = timer()
+        expected = original_listing(co)
+        middle = timer()
+        actual = backport_listing(co)
+        end = timer()
+        self.original_seconds += middle - start
+        self.backport_seconds += end - middle
+        self.code_objects += 1
+        self.instructions += len(backports_dis._decode_bytes(co.co_code)[0])
+        expected = normalize(expected)
+        actual = normalize(actual)
+        if expected != actual:
+            self.mismatches.append((path, co.co_name, co.co_firstlineno,
+                                    expected, actual))
+
+    def check_file(self, path):
+        """Compare every code object compiled from the source file *path*.
+        Files which do not compile under this Python are skipped."""
+        try:
+            with open(path, 'rU') as infile:
+                module = compile(infile.read(), path, 'exec')
+        except (SyntaxError, TypeError, ValueError):
+            self.skipped += 1
+            return
+        self.files += 1
+        for co in iter_code_objects(module):
+            self.check(co, path)
+
+    def write(self, file, show=5):
+        """Summarize the run, with line diffs of the first *show*
+        mismatches."""
+        for path, name, line, expected, actual in self.mismatches[:show]:
+            print('MISMATCH %s:%d %s' % (path, line, name), file=file)
+            for diff_line in difflib.unified_diff(
+                    expected, actual, 'dis', 'backports.dis', lineterm='',
+                    n=1):
+                print('    ' + diff_line, file=file)
+        print('%d files (%d skipped), %d code objects, %d instructions' % (
+            self.files, self.skipped, self.code_objects, self.instructions),
+            file=file)
+        print('%d mismatched code objects' % len(self.mismatches),
+              file=file)
+        for name, seconds in (('dis', self.original_seconds),
+                              ('backports.dis', self.backport_seconds)):
+            rate = self.instructions / seconds if seconds else 0
+            print('  %-14s %8.3fs %12.0f instructions/s' % (
+                name, seconds, rate), file=file)
+        if self.original_seconds and self.backport_seconds:
+            print('  backports.dis runs at %.2fx the speed of dis' % (
+                self.original_seconds / self.backport_seconds), file=file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('roots', nargs='*', metavar='directory',
+                        help='directories to search for .py files '
+                             '(default: stdlib and site-packages)')
+    parser.add_argument('--show', type=int, default=5,
+                        help='mismatches to show in full (default: 5)')
+    args = parser.parse_args(argv)
+    report = Report()
+    for path in find_sources(args.roots or default_roots()):
+        report.check_file(path)
+    report.write(sys.stdout, args.show)
+    return 1 if report.mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,16 @@
 # std
 import sys
 import math
+import os
+import json
+import pickle
 import contextlib
+import compileall
 import random
+import re
 import StringIO
 import types
+import zipfile
 import dis as original_dis
 # pytest
 import pytest
@@ -881,6 +887,762 @@ def test_backports_vs_original(object_name, object_to_test):
 ################################################################################
 
 
+def test_findlabels():
+    code = jumpy.__code__.co_code
+    labels = backports_dis.findlabels(code)
+    assert isinstance(labels, list)
+    assert labels == sorted(set(labels))
+    assert labels == [instr.offset
+                      for instr in backports_dis.get_instructions(jumpy)
+                      if instr.is_jump_target]
+    assert labels == sorted(set(original_dis.findlabels(code)))
+
+
+class CountingRepr(object):
+
+    calls = 0
+
+    def __repr__(self):
+        CountingRepr.calls += 1
+        return 'CountingRepr()'
+
+
+def test_lazy_argrepr():
+    CountingRepr.calls = 0
+    code = chr(backports_dis.opmap['LOAD_CONST']) + chr(0) + chr(0)
+    instr, = backports_dis._get_instructions_bytes(code,
+                                                   constants=[CountingRepr()])
+    assert instr.opname == 'LOAD_CONST'
+    assert isinstance(instr.argval, CountingRepr)
+    assert CountingRepr.calls == 0
+    assert instr.argrepr == 'CountingRepr()'
+    assert instr.argrepr == 'CountingRepr()'
+    assert CountingRepr.calls == 1
+    opname, opcode, arg, argval, argrepr, offset, starts_line, \
+        is_jump_target = instr
+    assert argrepr == instr[4] == 'CountingRepr()'
+    expected = backports_dis._Instruction('LOAD_CONST', opcode, 0, argval,
+                                          'CountingRepr()', 0, None, False)
+    assert instr == expected
+    assert expected == instr
+    assert hash(instr) == hash(expected)
+    assert repr(instr) == repr(expected)
+    assert instr._replace(offset=3)[4:6] == ('CountingRepr()', 3)
+    assert instr._asdict()['argrepr'] == 'CountingRepr()'
+
+
+def test_lazy_argrepr_tuple_access():
+    code = chr(backports_dis.opmap['LOAD_CONST']) + chr(0) + chr(0)
+    instr, = backports_dis._get_instructions_bytes(code,
+                                                   constants=[(1, 2, 3)])
+    assert '%s|%s|%s|%s|%s|%s|%s|%s' % instr == \
+        'LOAD_CONST|100|0|(1, 2, 3)|(1, 2, 3)|0|None|False'
+    assert '{0[4]:>10}'.format(instr) == ' (1, 2, 3)'
+    argrepr = (instr + ())[4]
+    assert argrepr == '(1, 2, 3)'
+    assert str(argrepr) == '(1, 2, 3)'
+    assert pickle.loads(pickle.dumps(instr)) == instr
+    assert type(pickle.loads(pickle.dumps(instr))[4]) is str
+    opname, opcode, arg, argval, argrepr, offset, starts_line, \
+        is_jump_target = instr
+    assert isinstance(argrepr, str)
+    assert argrepr.startswith('(1') and len(argrepr) == 9
+    assert argrepr + '!' == '(1, 2, 3)!'
+    assert type(tuple(instr)[4]) is type(list(instr)[4]) is str
+    assert json.loads(json.dumps(list(instr)))[4] == '(1, 2, 3)'
+
+
+@pytest.mark.parametrize('cache', [True, False])
+def test_bytecode_instruction_cache(cache):
+    bytecode = backports_dis.Bytecode(jumpy, cache=cache)
+    expected = list(backports_dis.get_instructions(jumpy))
+    assert list(bytecode) == expected
+    assert list(bytecode) == expected
+    assert len(bytecode) == len(expected)
+    assert bytecode[0] == expected[0]
+    assert bytecode[-1] == expected[-1]
+    assert (bytecode._instructions is not None) == cache
+    stream = StringIO.StringIO()
+    backports_dis.dis(jumpy, stream)
+    assert bytecode.dis() == stream.getvalue()
+
+
+@pytest.fixture
+def code_cache():
+    backports_dis.enable_cache(maxsize=2)
+    try:
+        yield
+    finally:
+        backports_dis.disable_cache()
+
+
+def test_code_cache(code_cache):
+    expected = list(backports_dis.get_instructions(jumpy))
+    assert backports_dis.cache_info() == (0, 1, 2, 1)
+    assert list(backports_dis.get_instructions(jumpy)) == expected
+    assert backports_dis.Bytecode(jumpy).info() == \
+        backports_dis.code_info(jumpy)
+    assert backports_dis.cache_info() == (3, 1, 2, 1)
+    backports_dis.code_info(outer)
+    backports_dis.code_info(closure)
+    assert backports_dis.cache_info() == (3, 3, 2, 2)
+    backports_dis.code_info(jumpy)
+    assert backports_dis.cache_info().misses == 4
+    backports_dis.cache_clear()
+    assert backports_dis.cache_info() == (0, 0, 2, 0)
+
+
+def test_code_cache_disabled():
+    assert backports_dis.cache_info() is None
+    backports_dis.cache_clear()
+    assert list(backports_dis.get_instructions(jumpy))
+
+
+class CountingStream(StringIO.StringIO):
+
+    def __init__(self):
+        StringIO.StringIO.__init__(self)
+        self.writes = 0
+
+    def write(self, s):
+        self.writes += 1
+        StringIO.StringIO.write(self, s)
+
+
+def test_buffered_output():
+    stream = CountingStream()
+    backports_dis.dis(jumpy, stream)
+    assert stream.writes == 1
+    assert stream.getvalue() == backports_dis.Bytecode(jumpy).dis()
+    assert stream.getvalue().endswith('RETURN_VALUE\n')
+
+
+@pytest.mark.parametrize('wrap', [str, bytearray, buffer, memoryview,
+                                  lambda code: memoryview(bytearray(code))])
+def test_raw_bytecode_buffers(wrap):
+    code = code_with_extended_arg
+    expected = StringIO.StringIO()
+    backports_dis.dis(code, expected)
+    actual = StringIO.StringIO()
+    backports_dis.dis(wrap(code), actual)
+    assert actual.getvalue() == expected.getvalue()
+    assert 'EXTENDED_ARG' in actual.getvalue()
+    padded = memoryview(bytearray('\xff' * 3 + code))[3:]
+    assert backports_dis.findlabels(padded) == \
+        backports_dis.findlabels(wrap(code))
+
+
+def test_raw_bytecode_str_without_nul():
+    expected = StringIO.StringIO()
+    backports_dis.dis(bytearray('\x01S'), expected)
+    actual = StringIO.StringIO()
+    backports_dis.dis('\x01S', actual)
+    assert actual.getvalue() == expected.getvalue()
+    assert 'POP_TOP' in actual.getvalue()
+    # Valid source is compiled, unless it is passed as a bytearray
+    source = StringIO.StringIO()
+    backports_dis.dis('S', source)
+    assert 'LOAD_NAME' in source.getvalue()
+    assert 'LOAD_NAME' not in expected.getvalue()
+    with pytest.raises(SyntaxError):
+        backports_dis.dis('x = = 1', StringIO.StringIO())
+
+
+def dis_to_string(x, **kwargs):
+    stream = StringIO.StringIO()
+    backports_dis.dis(x, stream, **kwargs)
+    return stream.getvalue()
+
+
+def test_dis_recursive():
+    assert 'Disassembly of' not in dis_to_string(outer)
+    assert dis_to_string(outer) == dis_to_string(outer, depth=0)
+    one_level = dis_to_string(outer, depth=1)
+    assert 'Disassembly of <code object f at' in one_level
+    assert '<code object inner at' in one_level
+    assert 'Disassembly of <code object inner at' not in one_level
+    unlimited = dis_to_string(outer, depth=None)
+    assert unlimited.startswith(one_level)
+    assert 'Disassembly of <code object inner at' in unlimited
+    assert unlimited == dis_to_string(outer, depth=10)
+
+
+def test_dis_recursive_cycle():
+    class Cyclic(object):
+        def method(self):
+            return lambda: self
+    Cyclic.self = Cyclic
+    actual = dis_to_string(Cyclic, depth=None)
+    assert actual.count('Disassembly of self:') == 1
+    assert actual.count('Disassembly of <code object <lambda> at') == 1
+
+
+def write_package(tmpdir):
+    """Write and byte compile a small package, returning its directory."""
+    package = tmpdir.mkdir('package')
+    package.join('__init__.py').write('x = 1\n')
+    package.mkdir('sub').join('mod.py').write('def f(a):\n    return a\n')
+    compileall.compile_dir(str(package), quiet=True)
+    return package
+
+
+def test_load_pyc(tmpdir):
+    package = write_package(tmpdir)
+    pyc = package.join('sub', 'mod.pyc')
+    with pyc.open('rb') as infile:
+        code = backports_dis._load_pyc(infile)
+    assert code.co_filename.endswith('mod.py')
+    assert backports_dis._load_code(str(pyc)).co_code == code.co_code
+    bad = package.join('bad.pyc')
+    bad.write('\0' * 16)
+    with pytest.raises(ValueError):
+        backports_dis._load_code(str(bad))
+
+
+def test_program_pyc_directory(tmpdir, monkeypatch, capsys):
+    package = write_package(tmpdir)
+    monkeypatch.setattr(sys, 'argv', ['dis', str(package)])
+    backports_dis._test()
+    out = capsys.readouterr()[0]
+    init = str(package.join('__init__.pyc'))
+    mod = str(package.join('sub', 'mod.pyc'))
+    assert out.index('Disassembly of %s:' % init) < \
+        out.index('Disassembly of %s:' % mod)
+    assert 'MAKE_FUNCTION' in out
+    assert 'STORE_NAME               0 (x)' in out
+
+
+@pytest.mark.parametrize('processes, chunksize', [(1, 8), (2, 1)])
+def test_dis_files(tmpdir, processes, chunksize):
+    package = write_package(tmpdir)
+    paths = [str(package.join('sub', 'mod.pyc')), str(package)]
+    expected = StringIO.StringIO()
+    for path in backports_dis._find_code_files(paths):
+        expected.write('Disassembly of %s:\n' % path)
+        backports_dis.dis(backports_dis._load_code(path), expected, depth=1)
+        expected.write('\n')
+    actual = StringIO.StringIO()
+    backports_dis.dis_files(paths, actual, depth=1, processes=processes,
+                            chunksize=chunksize)
+    address = re.compile(' at 0x[0-9a-f]+')
+    assert address.sub('', actual.getvalue()) == \
+        address.sub('', expected.getvalue())
+    assert actual.getvalue().count('Disassembly of <code object f at') == 2
+
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_STORED,
+                                         zipfile.ZIP_DEFLATED])
+def test_pyc_archive_zip(tmpdir, compression):
+    package = write_package(tmpdir)
+    egg = str(tmpdir.join('package.egg'))
+    with zipfile.ZipFile(egg, 'w', compression) as archive:
+        for path in backports_dis._find_code_files([str(package)]):
+            archive.write(path, path[len(str(tmpdir)) + 1:])
+        archive.writestr('package/data.txt', 'not code')
+    with backports_dis.PycArchive(egg) as archive:
+        assert archive.names() == ['package/__init__.pyc',
+                                   'package/sub/mod.pyc']
+        code = archive.get_code('package/sub/mod.pyc', 'f')
+        assert [instr.opname for instr in backports_dis.Bytecode(code)] == \
+            ['LOAD_FAST', 'RETURN_VALUE']
+        with pytest.raises(KeyError):
+            archive.get_code('package/data.txt')
+        with pytest.raises(KeyError):
+            archive.get_code('package/sub/mod.pyc', 'g')
+
+
+def test_pyc_archive_file(tmpdir):
+    package = write_package(tmpdir)
+    with backports_dis.PycArchive(str(package.join('__init__.pyc'))) as pyc:
+        assert pyc.names() == ['__init__.pyc']
+        assert pyc.get_code('__init__.pyc').co_names == ('x',)
+
+
+def test_columns():
+    bytecode = backports_dis.Bytecode(jumpy, first_line=1000)
+    columns = bytecode.columns()
+    instructions = list(bytecode)
+    assert len(columns) == len(instructions)
+    assert list(columns.opcode) == [i.opcode for i in instructions]
+    assert list(columns.offset) == [i.offset for i in instructions]
+    assert list(columns.is_jump_target) == [i.is_jump_target
+                                            for i in instructions]
+    assert list(columns.arg) == [-1 if i.arg is None else i.arg
+                                 for i in instructions]
+    line = -1
+    for instr, actual in zip(instructions, columns.line):
+        line = instr.starts_line or line
+        assert actual == line
+    assert columns.line[0] == instructions[0].starts_line > 1000
+    names = [i.argval for i in instructions
+             if i.opcode in backports_dis.hasname]
+    assert [columns.names[arg] for op, arg in zip(columns.opcode, columns.arg)
+            if op in backports_dis.hasname] == names
+
+
+def test_columns_to_numpy():
+    numpy = pytest.importorskip('numpy')
+    columns = backports_dis.Bytecode(jumpy).columns()
+    arrays = columns.to_numpy()
+    assert arrays['offset'].tolist() == columns.offset.tolist()
+    assert arrays['opcode'].dtype == numpy.uint8
+    columns.offset[0] = 99
+    assert arrays['offset'][0] == 99
+    empty = backports_dis.InstructionColumns(jumpy.__code__, '', {}, ())
+    empty = empty.to_numpy()
+    assert len(empty['opcode']) == 0
+
+
+@pytest.mark.parametrize('first_line', [None, 1000])
+def test_line_lookup(first_line):
+    bytecode = backports_dis.Bytecode(jumpy, first_line=first_line)
+    line = None
+    ends = [instr.offset for instr in bytecode][1:]
+    ends.append(len(jumpy.__code__.co_code))
+    for instr, end in zip(bytecode, ends):
+        line = instr.starts_line or line
+        for offset in range(instr.offset, end):
+            assert bytecode.line_for_offset(offset) == line
+        if instr.starts_line is not None:
+            assert instr.offset in \
+                bytecode.offsets_for_line(instr.starts_line)
+    assert bytecode.line_for_offset(-1) is None
+    assert bytecode.offsets_for_line(0) == []
+    starts = [(offset, line) for offset, line in
+              backports_dis.findlinestarts(jumpy.__code__)]
+    offset, line = starts[3]
+    line += bytecode._line_offset
+    assert bytecode.offsets_for_line(line) == [offset]
+
+
+@pytest.mark.parametrize('cache', [True, False])
+def test_dis_window(cache):
+    bytecode = backports_dis.Bytecode(jumpy, current_offset=152, cache=cache)
+    full = [line for line in bytecode.dis().splitlines() if line]
+    bytecode = backports_dis.Bytecode(jumpy, current_offset=152, cache=cache)
+    index = [i for i, line in enumerate(full) if '-->' in line][0]
+    window = bytecode.dis(around=152, context=2).splitlines()
+    assert [line for line in window if line] == full[index - 2:index + 3]
+    assert bytecode.dis(around=0, context=1).splitlines() == full[:2]
+    assert bytecode.dis(around=10000) == ''
+    assert '   42 LOAD_FAST' in bytecode.dis(start=39, stop=45)
+    ranged = [line for line in bytecode.dis(start=39, stop=45).splitlines()
+              if line]
+    assert len(ranged) == 2
+
+
+def test_window_stops_decoding():
+    code = backports_dis._byte_view(jumpy.__code__.co_code)
+    ops = backports_dis._window_ops(code, around=13, context=1)
+    assert [offset for offset, op, arg in ops] == [12, 13, 16]
+    # a truncated instruction at the end would fail if it were decoded
+    truncated = code + bytearray('\xff')
+    assert backports_dis._window_ops(truncated, start=0, stop=6) == \
+        backports_dis._decode_bytes(code)[0][:2]
+
+
+def test_control_flow_graph():
+    graph = backports_dis.ControlFlowGraph(jumpy)
+    instructions = list(backports_dis.Bytecode(jumpy))
+    assert [instr for block in graph.blocks
+            for instr in block.instructions] == instructions
+    assert set(block.start for block in graph.blocks) >= \
+        set(instr.offset for instr in instructions if instr.is_jump_target)
+    for block in graph.blocks:
+        for successor, kind in block.successors:
+            assert (block, kind) in successor.predecessors
+
+    def edges(offset):
+        return [(successor.start, kind)
+                for successor, kind in graph.block_at(offset).successors]
+
+    for_iter = graph.block_at(13)
+    assert edges(13) == [(61, backports_dis.CONDITIONAL),
+                         (16, backports_dis.FALLTHROUGH)]
+    assert edges(36) == [(13, backports_dis.UNCONDITIONAL)]
+    assert edges(54) == [(67, backports_dis.UNCONDITIONAL)]  # BREAK_LOOP
+    assert (152, backports_dis.EXCEPTION) in edges(134)
+    assert (198, backports_dis.EXCEPTION) in edges(152)
+    assert edges(198) == []
+    assert graph.block_at(0) is graph.entry
+    assert graph.dominates(graph.entry, graph.block_at(198))
+    assert graph.dominates(for_iter, graph.block_at(42))
+    assert not graph.dominates(graph.block_at(42), graph.block_at(61))
+    assert graph.block_at(61).idom is for_iter
+    assert [block.start for block in
+            graph.dominators(graph.block_at(198))] == [198, 134, 70, 67, 13, 0]
+
+
+def test_control_flow_graph_unreachable():
+    graph = backports_dis.ControlFlowGraph(jumpy)
+    dead = graph.block_at(39)  # JUMP_FORWARD after JUMP_ABSOLUTE
+    assert dead.predecessors == []
+    assert graph.dominators(dead) == []
+    assert not graph.dominates(graph.entry, dead)
+    assert graph.dominators(graph.entry) == [graph.entry]
+
+
+@pytest.mark.parametrize('x', [
+    jumpy, tricky, outer, generator, bug708901, bug1333982, closure,
+    complex_function_1, complex_function_2, function_with_try,
+    compound_stmt_str, list_comprehension, dict_comprehension,
+])
+def test_max_stack_depth(x):
+    pending = [backports_dis._get_code_object(x)]
+    while pending:
+        co = pending.pop()
+        assert backports_dis.max_stack_depth(co) == co.co_stacksize
+        pending.extend(c for c in co.co_consts if hasattr(c, 'co_code'))
+
+
+def test_stack_depths():
+    depths = backports_dis.stack_depths(jumpy)
+    assert [instr.offset for instr, _ in depths] == \
+        [instr.offset for instr in backports_dis.get_instructions(jumpy)]
+    by_offset = dict((instr.offset, depth) for instr, depth in depths)
+    assert by_offset[0] == 0
+    assert by_offset[39] is None  # unreachable JUMP_FORWARD
+    for instr, depth in depths:
+        if instr.opname == 'RETURN_VALUE':
+            assert depth == 1
+
+
+def test_stack_effect():
+    stack_effect = backports_dis.stack_effect
+    for name, op in backports_dis.opmap.items():
+        if name == 'STOP_CODE':
+            continue
+        if op < backports_dis.HAVE_ARGUMENT:
+            assert isinstance(stack_effect(op), int)
+            with pytest.raises(ValueError):
+                stack_effect(op, 0)
+        else:
+            assert isinstance(stack_effect(op, 0), int)
+            with pytest.raises(ValueError):
+                stack_effect(op)
+    assert stack_effect(backports_dis.opmap['BUILD_TUPLE'], 3) == -2
+    assert stack_effect(backports_dis.opmap['CALL_FUNCTION'], 0x0102) == -4
+    assert stack_effect(backports_dis.opmap['CALL_FUNCTION_VAR_KW'], 1) == -3
+    with pytest.raises(ValueError):
+        stack_effect(backports_dis.opmap['STOP_CODE'])
+    with pytest.raises(ValueError):
+        stack_effect(256)
+
+
+def test_diff():
+    old = compile('def f(x):\n'
+                  '    y = x + 1\n'
+                  '    def g():\n'
+                  '        return y\n'
+                  '    return g\n', 'old', 'exec')
+    new = compile('def f(x):\n'
+                  '    y = x + 2\n'
+                  '    print y\n'
+                  '    def g():\n'
+                  '        return y\n'
+                  '    return g\n'
+                  'def h(): pass\n', 'new', 'exec')
+    assert backports_dis.diff(old, old) == []
+    assert backports_dis.diff(backports_dis.Bytecode(jumpy), jumpy) == []
+    diffs = dict((d.path, d) for d in backports_dis.diff(old, new))
+    assert sorted(diffs) == [('<module>',), ('<module>', 'f'),
+                             ('<module>', 'h')]
+    assert diffs['<module>', 'h'].old is None
+    changes = [(c.tag, c.old and c.old.argrepr, c.new and c.new.opname)
+               for c in diffs['<module>', 'f'].changes]
+    assert changes == [('replace', '1', 'LOAD_CONST'),
+                       ('insert', None, 'LOAD_DEREF'),
+                       ('insert', None, 'PRINT_ITEM'),
+                       ('insert', None, 'PRINT_NEWLINE')]
+
+
+def test_diff_opcodes():
+    opcodes = backports_dis._diff_opcodes('abcabba', 'cbabac')
+    assert sum(i2 - i1 + j2 - j1 for _, i1, i2, j1, j2 in opcodes) == 5
+    result = []
+    i = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        result += 'abcabba'[i:i1] + 'cbabac'[j1:j2]
+        i = i2
+    assert ''.join(result) + 'abcabba'[i:] == 'cbabac'
+
+
+def test_diff_jumps():
+    instructions = list(backports_dis.Bytecode(jumpy))
+    jump = [instr.offset for instr in instructions].index(36)
+    assert instructions[jump][:4] == ('JUMP_ABSOLUTE', 113, 13, 13)
+    instructions[jump] = instructions[jump]._replace(argval=0)
+    new = backports_dis.assemble(instructions, jumpy.__code__)
+    assert new.co_code != jumpy.__code__.co_code
+    [diff] = backports_dis.diff(jumpy, new)
+    assert [(c.tag, c.old.argval, c.new.argval) for c in diff.changes] == \
+        [('replace', 13, 0)]
+
+    old = compile('for i in x:\n    if i:\n        break\n', 'old', 'exec')
+    new = compile('y = 1\nfor i in x:\n    if i:\n        break\n',
+                  'new', 'exec')
+    [diff] = backports_dis.diff(old, new)
+    assert [c.tag for c in diff.changes] == ['insert', 'insert']
+
+
+def test_diff_large():
+    body = ''.join('    x%d = x%d + %d\n' % (i, i, i) for i in range(5000))
+    old = compile('def f():\n' + body, 'old', 'exec')
+    body = body.replace('x2500 + 2500', 'x2500 - 2500')
+    new = compile('def f():\n' + body, 'new', 'exec')
+    [diff] = backports_dis.diff(old, new)
+    changes = [(c.tag, c.old.opname, c.new.opname) for c in diff.changes]
+    assert changes == [('replace', 'BINARY_ADD', 'BINARY_SUBTRACT')]
+
+
+def test_opcode_stats():
+    stats = backports_dis.OpcodeStats()
+    stats.add(outer)
+    codes = [outer.__code__]
+    instructions = []
+    for co in codes:
+        instructions += backports_dis.get_instructions(co)
+        codes += [c for c in co.co_consts if hasattr(c, 'co_code')]
+    assert stats.total == len(instructions)
+    assert len(stats.functions) == len(codes)
+    assert [count for _, _, name, count in stats.functions
+            if name == 'outer'] == [len(list(backports_dis.Bytecode(outer)))]
+    for opname, count in stats.most_common():
+        assert count == sum(1 for i in instructions if i.opname == opname)
+    first, second = instructions[:2]
+    assert stats.pairs[first.opcode << 8 | second.opcode] >= 1
+    assert stats.most_common_pairs(1)[0][1] == max(stats.pairs.values())
+
+    stream = StringIO.StringIO()
+    stats.dump(stream)
+    loaded = backports_dis.OpcodeStats.load(StringIO.StringIO(
+        stream.getvalue()))
+    loaded.update(stats)
+    assert loaded.total == 2 * stats.total
+    assert loaded.pairs == stats.pairs + stats.pairs
+    assert loaded.functions == stats.functions * 2
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_opcode_stats_files(tmpdir, processes):
+    package = write_package(tmpdir)
+    stats = backports_dis.opcode_stats([str(package)], processes=processes)
+    expected = backports_dis.OpcodeStats()
+    expected.add(str(package))
+    assert stats.opcodes == expected.opcodes
+    assert stats.pairs == expected.pairs
+    assert sorted(name for _, _, name, _ in stats.functions) == \
+        ['<module>', '<module>', 'f']
+    module = backports_dis.OpcodeStats()
+    module.add(backports_dis)
+    assert module.opcodes[backports_dis.opmap['LOAD_GLOBAL']] > 0
+
+
+@pytest.fixture
+def disk_cache(tmpdir):
+    directory = str(tmpdir.join('cache'))
+    backports_dis.enable_disk_cache(directory)
+    try:
+        yield directory
+    finally:
+        backports_dis.disable_disk_cache()
+
+
+def test_disk_cache(disk_cache, code_cache):
+    expected = list(backports_dis.get_instructions(jumpy))
+    info = backports_dis.code_info(jumpy)
+    assert backports_dis.disk_cache_info()[:2] == (0, 2)
+    # A fresh process would start with an empty memory cache.
+    backports_dis.enable_disk_cache(disk_cache)
+    backports_dis.cache_clear()
+    assert list(backports_dis.get_instructions(jumpy)) == expected
+    assert backports_dis.code_info(jumpy) == info
+    assert backports_dis.disk_cache_info()[:2] == (2, 0)
+    shifted = list(backports_dis.Bytecode(jumpy, first_line=1000))
+    backports_dis.disable_disk_cache()
+    assert shifted == list(backports_dis.Bytecode(jumpy, first_line=1000))
+    backports_dis.enable_disk_cache(disk_cache, maxbytes=1)
+    assert backports_dis.disk_cache_info().currsize == 0
+    assert os.listdir(disk_cache) == []
+
+
+def test_disk_cache_key(disk_cache):
+    first = compile('x = 1', 'first', 'exec')
+    second = compile('y = 1', 'first', 'exec')
+    assert backports_dis.code_info(first) != backports_dis.code_info(second)
+    assert list(backports_dis.get_instructions(second))[1].argval == 'y'
+    assert backports_dis.disk_cache_info()[:2] == (0, 3)
+    assert backports_dis.code_info(compile('x = 1', 'first', 'exec')) == \
+        backports_dis.code_info(first)
+    assert backports_dis.disk_cache_info()[:2] == (2, 3)
+
+
+def test_disk_cache_unmarshallable(disk_cache):
+    co = jumpy.__code__
+    co = types.CodeType(
+        co.co_argcount, co.co_nlocals, co.co_stacksize, co.co_flags,
+        co.co_code, co.co_consts + (object(),), co.co_names, co.co_varnames,
+        co.co_filename, co.co_name, co.co_firstlineno, co.co_lnotab,
+        co.co_freevars, co.co_cellvars)
+    backports_dis.disable_disk_cache()
+    expected = list(backports_dis.get_instructions(co))
+    info = backports_dis.code_info(co)
+    backports_dis.enable_disk_cache(disk_cache)
+    assert list(backports_dis.get_instructions(co)) == expected
+    assert list(backports_dis.Bytecode(co)) == expected
+    assert backports_dis.code_info(co) == info
+    assert os.listdir(disk_cache) == []
+
+
+def test_disk_cache_eviction(tmpdir, monkeypatch):
+    scans = []
+    entries = backports_dis._DiskCache._entries
+    monkeypatch.setattr(backports_dis._DiskCache, '_entries',
+                        lambda self: scans.append(1) or entries(self))
+    backports_dis.enable_disk_cache(str(tmpdir), maxbytes=20000)
+    try:
+        for i in range(400):
+            backports_dis.code_info(compile('x = %d' % i, 'f', 'exec'))
+        assert backports_dis.disk_cache_info().currsize <= 20000
+    finally:
+        backports_dis.disable_disk_cache()
+    assert len(scans) < 50
+
+
+@pytest.mark.parametrize('x', [
+    jumpy, tricky, outer, generator, closure, complex_function_1,
+    function_with_try, compound_stmt_str, list_comprehension,
+])
+def test_assemble_round_trip(x):
+    pending = [backports_dis._get_code_object(x)]
+    while pending:
+        co = pending.pop()
+        new = backports_dis.assemble(backports_dis.Bytecode(co))
+        for name in ('co_code', 'co_consts', 'co_names', 'co_varnames',
+                     'co_nlocals', 'co_flags', 'co_argcount', 'co_name',
+                     'co_firstlineno', 'co_freevars', 'co_cellvars'):
+            assert getattr(new, name) == getattr(co, name), name
+        assert list(backports_dis.findlinestarts(new)) == \
+            list(backports_dis.findlinestarts(co))
+        pending.extend(c for c in co.co_consts if hasattr(c, 'co_code'))
+
+
+def test_assemble_edit():
+    def f(x):
+        if x:
+            return 1
+        return 2
+    nop = backports_dis.Instruction('NOP', backports_dis.opmap['NOP'], None,
+                                    None, '', None, None, False)
+    instructions = list(backports_dis.Bytecode(f))
+    jump = [i.opname for i in instructions].index('POP_JUMP_IF_FALSE')
+    load = instructions[jump + 1]._replace(arg=None, argval='new')
+    instructions[jump + 1:jump + 2] = [nop] * 70000 + [load]
+    code = backports_dis.assemble(instructions, f.__code__)
+    g = types.FunctionType(code, globals())
+    assert (g(True), g(False)) == ('new', 2)
+    assert code.co_consts[:len(f.__code__.co_consts)] == f.__code__.co_consts
+    assert code.co_consts[-1] == 'new'
+    opnames = [i.opname for i in backports_dis.get_instructions(code)]
+    assert opnames[jump:jump + 2] == ['EXTENDED_ARG', 'POP_JUMP_IF_FALSE']
+    lines = [line for _, line in backports_dis.findlinestarts(code)]
+    assert lines == [line for _, line in backports_dis.findlinestarts(
+        f.__code__)]
+
+
+def test_assemble_shrink():
+    def f(x):
+        if x:
+            return 1
+        return 2
+    nop = backports_dis.Instruction('NOP', backports_dis.opmap['NOP'], None,
+                                    None, '', None, None, False)
+    instructions = list(backports_dis.Bytecode(f))
+    instructions[1:1] = [nop] * 70000
+    long_code = backports_dis.assemble(instructions, f.__code__)
+    assert 'EXTENDED_ARG' in [i.opname for i in
+                              backports_dis.get_instructions(long_code)]
+    # Deleting the padding brings the jump target back under 64K
+    code = backports_dis.assemble(
+        [i for i in backports_dis.Bytecode(long_code)
+         if i.opname not in ('NOP', 'EXTENDED_ARG')], long_code)
+    assert code.co_code == f.__code__.co_code
+    g = types.FunctionType(code, globals())
+    assert (g(True), g(False)) == (1, 2)
+
+
+def test_assemble_extended_arg_jump_target():
+    def f(n):
+        while 0 < n:
+            n = n - 1
+        return n
+    co = f.__code__
+    padding = tuple(range(-65536, 0))
+    template = types.CodeType(
+        co.co_argcount, co.co_nlocals, co.co_stacksize, co.co_flags,
+        co.co_code, padding, co.co_names, co.co_varnames, co.co_filename,
+        co.co_name, co.co_firstlineno, co.co_lnotab, co.co_freevars,
+        co.co_cellvars)
+    padded = backports_dis.assemble(backports_dis.Bytecode(co), template)
+    targets = [i for i in backports_dis.get_instructions(padded)
+               if i.is_jump_target]
+    assert 'EXTENDED_ARG' in [i.opname for i in targets]
+    again = backports_dis.assemble(backports_dis.Bytecode(padded))
+    assert again.co_code == padded.co_code
+    g = types.FunctionType(again, globals())
+    assert g(3) == 0
+
+
+def test_assemble_errors():
+    instructions = list(backports_dis.Bytecode(jumpy))
+    with pytest.raises(ValueError):
+        backports_dis.assemble([i._replace(offset=i.offset + 1)
+                                for i in instructions], jumpy.__code__)
+    with pytest.raises(ValueError):
+        backports_dis.assemble(instructions[::-1], jumpy.__code__)
+    empty = backports_dis.assemble([])
+    assert (empty.co_code, empty.co_name) == ('', '<assembly>')
+
+
+def test_all():
+    namespace = {}
+    exec('from backports.dis import *', namespace)
+    for name in backports_dis.__all__:
+        assert namespace[name] is getattr(backports_dis, name)
+    assert set(['stack_effect', 'assemble', 'diff', 'ControlFlowGraph',
+                'dis_files', 'opcode_stats', 'enable_cache',
+                'enable_disk_cache', 'stats', 'hasnargs']) <= set(namespace)
+
+
+def test_stats():
+    assert backports_dis.stats() is None
+    count = len(list(backports_dis.get_instructions(jumpy)))
+    backports_dis.enable_stats()
+    try:
+        stream = StringIO.StringIO()
+        backports_dis.dis(jumpy, stream)
+        counters, timers = backports_dis.stats(reset=True)
+        assert counters['code_objects'] == 1
+        assert counters['bytes_decoded'] == len(jumpy.__code__.co_code)
+        assert counters['instructions'] == count
+        assert counters['lines_written'] == stream.getvalue().count('\n')
+        assert counters['reprs'] > 0
+        assert set(timers) >= set(['linestarts', 'decode', 'resolve',
+                                   'format', 'write'])
+        assert all(seconds >= 0 for seconds in timers.values())
+        assert backports_dis.stats() == ({}, {})
+        backports_dis.findlabels(jumpy.__code__.co_code)
+        assert backports_dis.stats().counters == {
+            'bytes_decoded': len(jumpy.__code__.co_code)}
+        backports_dis.code_info(jumpy)
+        assert 'lookup' in backports_dis.stats().timers
+        backports_dis.reset_stats()
+        assert backports_dis.stats() == ({}, {})
+    finally:
+        backports_dis.disable_stats()
+    assert backports_dis.stats() is None
+
+
 
 ################################################################################
 #                                ByteCode Tests                                #